@@ -1,256 +1,102 @@
+import functools
+
 import numpy as np
-from skfuzzy import control as ctrl
-from skfuzzy import membership as mf
-import matplotlib.pyplot as plt
-
-# Initialise fuzzy variables
-ambient_light = ctrl.Antecedent(np.arange(0, 200, 0.1), 'ambient light')
-distance = ctrl.Antecedent(np.arange(0, 110, 0.1), 'distance')
-traffic_activity = ctrl.Antecedent(np.arange(0, 900, 1), 'traffic activity')
-pedestrian_activity = ctrl.Antecedent(np.arange(0, 500, 1), 'pedestrian activity')
-visibility = ctrl.Antecedent(np.arange(0, 2500, 1), 'visibility')
-time_of_day = ctrl.Antecedent(np.arange(0, 24, 0.1), 'time of day')
-brightness = ctrl.Consequent(np.arange(0, 18000, 1), 'brightness')
-colour_temp = ctrl.Consequent(np.arange(0, 6500, 1), 'colour temperature')
-
-# Create fuzzy sets/membership functions 
-ambient_light['very dark'] = mf.trimf(ambient_light.universe, [0, 10, 20]) #candlelight lit room
-ambient_light['dark'] = mf.trimf(ambient_light.universe, [10, 20, 30]) #room lit by a device screen
-ambient_light['moderate'] = mf.trimf(ambient_light.universe, [20, 85, 150]) #room with curtains drawn on a cloudy day
-ambient_light['bright'] = mf.trimf(ambient_light.universe, [100, 150, 200]) #well-lit indoor enviroment that provides decent visibility
-ambient_light['very bright'] = mf.trapmf(ambient_light.universe, [150, 175, 200, 200]) #bright (office lighting)
-# ambient_light.view()
-
-# Distance from the street lamp (meters)
-distance['very close'] = mf.trimf(distance.universe, [0, 0, 10])
-distance['close'] = mf.trimf(distance.universe, [5, 13, 20]) 
-distance['moderate'] = mf.trimf(distance.universe, [15, 32, 50])
-distance['far'] = mf.trimf(distance.universe, [40, 70, 100])
-distance['very far'] = mf.trapmf(distance.universe, [80, 100, 110, 110])
-# distance.view()
-
-# Traffic Activity per hour
-traffic_activity['light'] = mf.trimf(traffic_activity.universe, [0, 200, 400])
-traffic_activity['moderate'] = mf.trimf(traffic_activity.universe, [200, 400, 600])
-traffic_activity['heavy'] = mf.trapmf(traffic_activity.universe, [500, 700, 900, 900])
-# traffic_activity.view()
-
-# Pedestrian Activity per hour
-pedestrian_activity['light'] = mf.trimf(pedestrian_activity.universe, [0, 0, 100])
-pedestrian_activity['moderate'] = mf.trimf(pedestrian_activity.universe, [50, 150, 250])
-pedestrian_activity['heavy'] = mf.trimf(pedestrian_activity.universe, [200, 500, 500]) # why?
-# pedestrian_activity.view()
-
-# Visibility
-visibility['very_poor'] = mf.trimf(visibility.universe, [0, 25, 100])
-visibility['poor'] = mf.trimf(visibility.universe, [50, 125, 350])
-visibility['moderate'] = mf.trimf(visibility.universe, [300, 750, 1200])
-visibility['clear'] = mf.trimf(visibility.universe, [1000, 1750, 2300])
-visibility['excellent'] = mf.trapmf(visibility.universe, [2100, 2300, 2500, 2500])
-# visibility.view()
-
-# Time of Day
-time_of_day['midnight'] = mf.trimf(time_of_day.universe, [0, 1, 4])
-time_of_day['dawn'] = mf.trimf(time_of_day.universe, [3, 5.5, 7])
-time_of_day['day'] = mf.trimf(time_of_day.universe, [6, 13, 18])
-time_of_day['dusk'] = mf.trimf(time_of_day.universe, [17, 19, 21])
-time_of_day['night'] = mf.trapmf(time_of_day.universe, [20, 21, 24, 24])
-# time_of_day.view()
-
-# LED Brightness
-brightness['lower'] = mf.trimf(brightness.universe, [0, 1000, 3500])
-brightness['low'] = mf.trimf(brightness.universe, [2000, 5000, 8000])
-brightness['medium'] = mf.trimf(brightness.universe, [7000, 9500, 12000])
-brightness['high'] = mf.trimf(brightness.universe, [11000, 13500, 16000])
-brightness['higher'] = mf.trapmf(brightness.universe, [15000, 16500, 18000, 18000])
-# brightness.view()
-
-# colour Temperature
-colour_temp['warm glow'] = mf.trimf(colour_temp.universe, [0, 1000, 2700])
-colour_temp['warm white'] = mf.trimf(colour_temp.universe, [2500, 3000, 4000])
-colour_temp['neutral white'] = mf.trimf(colour_temp.universe, [3800, 4000, 5200])
-colour_temp['daylight white'] = mf.trapmf(colour_temp.universe, [5000, 5700, 6500, 6500])
-# colour_temp.view()
-
-
-# Define fuzzy rules (Include only the 18 most frequently occurring scenarios)
-
-# Morning Commute on Main Roads, School Zone at the Start of School Day, Morning Market or Street Vendor Area and Outdoor Train or Bus Stations:
-
-rule1 = ctrl.Rule((ambient_light['dark'] | ambient_light['moderate']) & 
-                  (distance['very close'] | distance['close'] | distance['moderate'] | distance['far'] | distance['very far']) & 
-                  (traffic_activity['heavy'] & pedestrian_activity['heavy']) & 
-                  (visibility['moderate'] | visibility['clear']) & 
-                  (time_of_day['dawn'] | time_of_day['day']), 
-                  (brightness['higher'], colour_temp['neutral white']))
-
-rule2 = ctrl.Rule((ambient_light['dark'] | ambient_light['moderate']) & 
-                  (distance['very close'] | distance['close'] | distance['moderate'] | distance['far'] | distance['very far']) & 
-                  (traffic_activity['heavy'] | pedestrian_activity['heavy']) & 
-                  (visibility['moderate'] | visibility['clear']) & 
-                  (time_of_day['dawn'] | time_of_day['day']), 
-                  (brightness['high'], colour_temp['neutral white']))
-
-# Morning Exercise in Parks:
-rule3 = ctrl.Rule((ambient_light['dark'] | ambient_light['moderate']) & 
-                  (distance['very close'] | distance['close'] | distance['moderate']) & 
-                  (traffic_activity['light'] & pedestrian_activity['heavy']) & 
-                  (visibility['moderate'] | visibility['clear']) & 
-                  (time_of_day['dawn'] | time_of_day['day']), 
-                  (brightness['high'], colour_temp['neutral white']))
-
-rule4 = ctrl.Rule((ambient_light['dark'] | ambient_light['moderate']) & 
-                  (distance['very close'] | distance['close'] | distance['moderate']) & 
-                  (traffic_activity['light'] & (pedestrian_activity['light'] | pedestrian_activity['moderate'])) & 
-                  (visibility['moderate'] | visibility['clear']) & 
-                  (time_of_day['dawn'] | time_of_day['day']), 
-                  (brightness['medium'], colour_temp['neutral white']))
-
-# Morning Delivery and Commercial Loading Zones (some conditions is covered by previous scenarios):
-rule5 = ctrl.Rule((ambient_light['dark'] | ambient_light['moderate']) & 
-                  (distance['very close'] | distance['close'] | distance['moderate']) & 
-                  (traffic_activity['moderate'] & pedestrian_activity['moderate']) & 
-                  (visibility['moderate'] | visibility['clear']) & 
-                  (time_of_day['dawn'] | time_of_day['day']), 
-                  (brightness['medium'], colour_temp['neutral white']))
-
-# Urban Residential Street and City Park Pathway at Night:
-rule6 = ctrl.Rule((ambient_light['moderate']) & 
-                  (distance['very close'] | distance['close']) & 
-                  (traffic_activity['light'] & (pedestrian_activity['light'] | pedestrian_activity['moderate'])) & 
-                  (visibility['moderate'] | visibility['clear']) & 
-                  (time_of_day['night']), 
-                  (brightness['higher'], colour_temp['warm white']))
-
-# Urban Main Road During Evening Rush Hour:
-rule7 = ctrl.Rule((ambient_light['bright']) & 
-                  (distance['close'] | distance['moderate'] | distance['far']) & 
-                  (traffic_activity['heavy'] & (pedestrian_activity['light'] | pedestrian_activity['moderate'])) & 
-                  (visibility['moderate'] | visibility['clear']) & 
-                  (time_of_day['dusk'] | time_of_day['night']), 
-                  (brightness['high'], colour_temp['neutral white']))
-
-# Commercial District During Evening Shopping and City Square or Plaza During Evening Events:
-rule8 = ctrl.Rule((ambient_light['bright']) & 
-                  (distance['very close'] | distance['close'] | distance['moderate']) & 
-                  ((traffic_activity['light'] | traffic_activity['moderate']) & (pedestrian_activity['heavy'])) & 
-                  (visibility['moderate'] | visibility['clear'] | visibility['excellent']) & 
-                  (time_of_day['dusk'] | time_of_day['night']), 
-                  (brightness['high'], colour_temp['neutral white']))
-
-# Busy Urban Intersection at Night:
-rule9 = ctrl.Rule((ambient_light['very bright']) & 
-                  (distance['very close'] | distance['close'] | distance['moderate']) & 
-                  ((traffic_activity['heavy']) & (pedestrian_activity['heavy'])) & 
-                  (visibility['moderate'] | visibility['clear'] | visibility['excellent']) & 
-                  (time_of_day['night']), 
-                  (brightness['higher'], colour_temp['neutral white']))
-
-# Suburban Residential Street at Dusk, Pedestrian Bridge and Residential Cul-de-Sac at Night:
-rule10 = ctrl.Rule((ambient_light['moderate']) & 
-                  (distance['very close'] | distance['close']) & 
-                  (traffic_activity['light'] & pedestrian_activity['light']) & 
-                  (visibility['moderate'] | visibility['clear']) & 
-                  (time_of_day['dusk'] | time_of_day['night'] | time_of_day['midnight']), 
-                  (brightness['medium'], colour_temp['warm white']))
-
-# Highway Exit Ramp at Night:
-rule11 = ctrl.Rule((ambient_light['bright']) & 
-                  (distance['close'] | distance['moderate'] | distance['far']) & 
-                  (traffic_activity['light'] | traffic_activity['moderate']) & (pedestrian_activity['light']) & 
-                  (visibility['moderate'] | visibility['clear']) & 
-                  (time_of_day['night'] | time_of_day['midnight']), 
-                  (brightness['medium'], colour_temp['neutral white']))
-
-# Outdoor Dining Area in the Evening:
-rule12 = ctrl.Rule((ambient_light['moderate']) & 
-                  (distance['very close'] | distance['close']) & 
-                  (traffic_activity['light'] & pedestrian_activity['heavy']) & 
-                  (visibility['moderate'] | visibility['clear']) & 
-                  (time_of_day['dusk'] | time_of_day['night']), 
-                  (brightness['high'], colour_temp['neutral white']))
-
-# Sports Field Lighting at Night:
-rule13 = ctrl.Rule((ambient_light['very bright']) & 
-                  (distance['close'] | distance['moderate']) & 
-                  (traffic_activity['light'] & pedestrian_activity['light']) & 
-                  (visibility['clear'] | visibility['excellent']) & 
-                  (time_of_day['dusk'] | time_of_day['night']), 
-                  (brightness['low'], colour_temp['daylight white']))
-
-rule14 = ctrl.Rule((ambient_light['very bright']) & 
-                  (distance['close'] | distance['moderate']) & 
-                  (traffic_activity['light'] & pedestrian_activity['moderate']) & 
-                  (visibility['clear'] | visibility['excellent']) & 
-                  (time_of_day['dusk'] | time_of_day['night']), 
-                  (brightness['medium'], colour_temp['daylight white']))
-
-rule15 = ctrl.Rule((ambient_light['very bright']) & 
-                  (distance['close'] | distance['moderate']) & 
-                  (traffic_activity['light'] & pedestrian_activity['heavy']) & 
-                  (visibility['clear'] | visibility['excellent']) & 
-                  (time_of_day['dusk'] | time_of_day['night']), 
-                  (brightness['high'], colour_temp['daylight white']))
-
-rules = [rule1, rule2, rule3, rule4, rule5, rule6, rule7, rule8, rule9, rule10, rule11, rule12, rule13, rule14, rule15]
-
-train_ctrl = ctrl.ControlSystem(rules=rules)
-train = ctrl.ControlSystemSimulation(control_system=train_ctrl)
+
+from model_definition import build_rules, build_variables, load_definition
+
+# Accepted range of every input, as (min, max); main() asks for values within these
+INPUT_RANGES = {
+    'ambient light': (0, 200),
+    'distance': (0, 110),
+    'traffic activity': (0, 900),
+    'pedestrian activity': (0, 500),
+    'visibility': (0, 2500),
+    'time of day': (0, 24)
+}
+
+# Values the inputs that are not being swept are held at in a control surface
+SURFACE_FIXED_VALUES = {
+    'ambient light': 100,
+    'distance': 55,
+    'traffic activity': 300,
+    'pedestrian activity': 200,
+    'visibility': 1000,
+    'time of day': 12
+}
+
+
+class LightingSystem:
+    # Everything the fuzzy model is made of: the fuzzy variables (as attributes named
+    # after their "name" in the model definition), the rules, the control system and a
+    # simulation to run it with, plus the definition's fallback ({output label: value} for
+    # readings no rule covers, or None). The fallback is also set on train_ctrl, which is
+    # where BatchEngine looks for it, so every engine built on the system returns it.
+
+    def __init__(self, variables, rules, fallback=None):
+        from skfuzzy import control as ctrl
+
+        for name, variable in variables.items():
+            setattr(self, name, variable)
+        self.variables = variables
+        self.rules = rules
+        self.fallback = fallback
+        self.train_ctrl = ctrl.ControlSystem(rules=rules)
+        self.train_ctrl.fallback = fallback
+        self.train = ctrl.ControlSystemSimulation(control_system=self.train_ctrl)
+
+    def fuzzy_variables(self):
+        # Fuzzy variables keyed by the labels used for train.input / train.output
+        return {variable.label: variable for variable in self.variables.values()}
+
+
+@functools.lru_cache(maxsize=None)
+def lighting_system(step_scale=1, path=None):
+    # Build the fuzzy model the first time it is needed, not when A1 is imported.
+    # The variables, membership functions and rules come from a model definition
+    # (lighting_model.json unless path names another one, see model_definition.py).
+    # step_scale multiplies the sampling step of every universe (e.g. 10 for a
+    # 10-lumen brightness step); the membership breakpoints stay the same.
+    definition = load_definition(path)
+    variables = build_variables(definition, step_scale)
+    return LightingSystem(variables, build_rules(definition, variables), definition.get('fallback'))
+
+
+# Names that used to be built at import time; they are still available as A1.<name>,
+# but only built on first access
+_LAZY_NAMES = {'ambient_light', 'distance', 'traffic_activity', 'pedestrian_activity', 'visibility',
+               'time_of_day', 'brightness', 'colour_temp', 'rules', 'train_ctrl', 'train'}
+
+
+def __getattr__(name):
+    if name in _LAZY_NAMES:
+        return getattr(lighting_system(), name)
+    if name.startswith('rule') and name[4:].isdigit() and 1 <= int(name[4:]) <= len(lighting_system().rules):
+        return lighting_system().rules[int(name[4:]) - 1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def control_surface_grid(first_variable, second_variable, resolution=100, fallback=None):
+    # Sweep two inputs over their universes, keeping the others at SURFACE_FIXED_VALUES.
+    # The whole grid goes through the batch engine at once; where no rule fires the
+    # outputs are the fallback values ({output label: value}) if given, else the model
+    # definition's fallback, else NaN.
+    from batch_engine import BatchEngine
+    from surface_atlas import surface_grid
+
+    train_ctrl = lighting_system().train_ctrl
+    x, y, inputs = surface_grid(train_ctrl, first_variable, second_variable, resolution, SURFACE_FIXED_VALUES)
+    z_brightness, z_colour_temp = BatchEngine(train_ctrl, centroid='breakpoints', fallback=fallback).compute(inputs)
+    return x, y, z_brightness.reshape(x.shape), z_colour_temp.reshape(x.shape)
+
 
 def show_3d_graph(first_variable, second_variable):
+    import matplotlib.pyplot as plt
 
-    fuzzy_variables = {
-    'ambient light': ambient_light,
-    'distance': distance,
-    'traffic activity': traffic_activity,
-    'pedestrian activity': pedestrian_activity,
-    'visibility': visibility,
-    'time of day': time_of_day,
-    'brightness': brightness,
-    'colour temperature': colour_temp
-    }
-    
-    # Create meshgrid for the two chosen variables
-    x, y = np.meshgrid(np.linspace(fuzzy_variables[first_variable].universe.min(), fuzzy_variables[first_variable].universe.max(), 100),
-                   np.linspace(fuzzy_variables[second_variable].universe.min(), fuzzy_variables[second_variable].universe.max(), 100))
-
-    # Initialize arrays to hold the outputs
-    z_brightness = np.zeros_like(x, dtype=float)
-    z_colour_temp = np.zeros_like(x, dtype=float)
-
-    # Constants for other variables (could be adjusted)
-    fixed_values = {
-        'ambient light': 100,
-        'distance': 55,
-        'traffic activity': 300,
-        'pedestrian activity': 200,
-        'visibility': 1000,
-        'time of day': 12
-    }
-
-    # Loop through grid
-    for i, r in enumerate(x):
-        for j, c in enumerate(r):
-            # Set the chosen input variables
-            train.input[first_variable] = x[i, j]
-            train.input[second_variable] = y[i, j]
-
-            # Set the constant input variables for non-chosen ones
-            for var in fixed_values:
-                if var != first_variable and var != second_variable:
-                    train.input[var] = fixed_values[var]
-
-            try:
-                train.compute()
-            except:
-                z_brightness[i, j] = float('inf')
-                z_colour_temp[i, j] = float('inf')
-
-            z_brightness[i, j] = train.output['brightness']
-            z_colour_temp[i, j] = train.output['colour temperature']
-
-    # Function to plot
+    x, y, z_brightness, z_colour_temp = control_surface_grid(first_variable, second_variable)
+
+    # Function to plot (grid points where no rule fired are drawn at 0)
     def plot3d(x, y, z, label):
+        z = np.nan_to_num(z, nan=0.0)
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
         ax.plot_surface(x, y, z, rstride=1, cstride=1, cmap='viridis', linewidth=0.4, antialiased=True)
@@ -308,9 +154,12 @@ def show_graph(train):
 
         
         if choice == "1":
+            import matplotlib.pyplot as plt
+
             # Viewing the result on the graph based on the values of the inputs
-            brightness.view(sim=train)
-            colour_temp.view(sim=train)
+            system = lighting_system()
+            system.brightness.view(sim=train)
+            system.colour_temp.view(sim=train)
             plt.show()
         elif choice == "2":
             first_var, second_var = choose_input_variables()
@@ -417,18 +266,19 @@ def main():
 
 
     # Collect data from the user with error handling
-    ambient_light_input = get_float_input("💡 Enter the Ambient Light Level (0-200, eg: 90): ", 0, 200)
-    distance_input = get_float_input("📏 Enter the Distance from the Street Lamp (0-110, eg: 15): ", 0, 110)
-    traffic_activity_input = get_float_input("🚗 Enter the Traffic Activity per Hour (0-900, eg: 200): ", 0, 900)
-    pedestrian_activity_input = get_float_input("🚶 Enter the Pedestrian Activity per Hour (0-500, eg: 150): ", 0, 500)
-    visibility_input = get_float_input("👀 Enter the Visibility Level (0-2500, eg:750): ", 0, 2500)
-    time_of_day_input = get_float_input("🕒 Enter the Time of Day (0-24, eg:21): ", 0, 24)
+    ambient_light_input = get_float_input("💡 Enter the Ambient Light Level (0-200, eg: 90): ", *INPUT_RANGES['ambient light'])
+    distance_input = get_float_input("📏 Enter the Distance from the Street Lamp (0-110, eg: 15): ", *INPUT_RANGES['distance'])
+    traffic_activity_input = get_float_input("🚗 Enter the Traffic Activity per Hour (0-900, eg: 200): ", *INPUT_RANGES['traffic activity'])
+    pedestrian_activity_input = get_float_input("🚶 Enter the Pedestrian Activity per Hour (0-500, eg: 150): ", *INPUT_RANGES['pedestrian activity'])
+    visibility_input = get_float_input("👀 Enter the Visibility Level (0-2500, eg:750): ", *INPUT_RANGES['visibility'])
+    time_of_day_input = get_float_input("🕒 Enter the Time of Day (0-24, eg:21): ", *INPUT_RANGES['time of day'])
     
     print("\n🔍 Computing the ideal light settings...\n")
     print("************************************************************************************")
 
 
     # Define the values for the inputs
+    train = lighting_system().train
     train.input['ambient light'] = ambient_light_input
     train.input['distance'] = distance_input
     train.input['traffic activity'] = traffic_activity_input
@@ -438,6 +288,19 @@ def main():
     
     # Compute the outputs
     train.compute()
+
+    # skfuzzy leaves the outputs out when no rule fires
+    if 'brightness' not in train.output:
+        fallback = lighting_system().fallback
+        if not fallback:
+            print("\n❗️ None of the scenarios covers these readings, so there is no output to show.")
+            print("   Run rule_coverage.py to see which input regions no rule covers.")
+            return
+        print("\n❗️ None of the scenarios covers these readings; using the model's fallback settings.")
+        print(f"💡 Brightness Level: {fallback.get('brightness', 'not set')}")
+        print(f"🌈 Colour Temperature: {fallback.get('colour temperature', 'not set')} \n")
+        print("************************************************************************************")
+        return
     
     # Print the output values
     print("\n🎉 Predicted Output Values:")
@@ -0,0 +1,460 @@
+import time
+
+import numpy as np
+
+from A1 import INPUT_RANGES
+from rule_dag import RuleDAG, tree_operations
+from support_index import SupportIndex
+
+# Column order of the N x 6 input arrays (same order as choose_input_variables in A1.py)
+INPUT_LABELS = ['ambient light', 'distance', 'traffic activity', 'pedestrian activity', 'visibility', 'time of day']
+OUTPUT_LABELS = ['brightness', 'colour temperature']
+
+# Accepted range of each input, one row per column (the bounds main() passes to get_float_input)
+INPUT_BOUNDS = np.array([INPUT_RANGES[label] for label in INPUT_LABELS], dtype=float)
+
+# Rough costs used to choose between evaluating the shared rule graph over a batch and
+# firing only the candidate rules one by one, in units of one element of a numpy AND/OR
+# (about a nanosecond): the fixed cost of one numpy call, and of one element picked out
+# of and written back to a membership array
+CALL_COST = 800
+GATHER_COST = 40
+# ...and of looking up one input of one reading in the SupportIndex (two binary searches
+# and a few packed-row operations); on top of that the lookup costs about one unit per
+# rule per reading to unpack the candidates
+LOOKUP_COST = 100
+
+# Largest difference we accept between the batch engine and train.compute()
+# (lumens for brightness, kelvin for colour temperature)
+TOLERANCE = 0.5
+
+
+class BatchEngine:
+    # Evaluates a skfuzzy ControlSystem (or a CompiledModel) on whole arrays of readings
+    # at once. The engine reads the universes, membership arrays and rules straight from
+    # the control system, so it stays in sync with whatever A1.py defines.
+
+    # centroid='sampled' integrates over every sample of the output universe;
+    # centroid='breakpoints' works on the corners of the piecewise-linear output sets,
+    # so its cost depends on the number of output terms, not on the universe step.
+    CENTROID_METHODS = ('sampled', 'breakpoints')
+
+    # rule_index=True looks up which rules can fire for each reading (see SupportIndex)
+    # and only evaluates those, whenever the lookup is estimated to cost less than firing
+    # every rule would (single readings, large rule bases); the results are the same either way.
+
+    # share_subexpressions=True evaluates all rules through one RuleDAG, so a subexpression
+    # several rules read (e.g. "visibility[moderate] | visibility[clear]") is computed once
+    # per batch; the results are bit-for-bit the same as evaluating each rule on its own.
+
+    # fallback={output label: value} is returned for readings where no rule fires, instead
+    # of NaN; by default it comes from the model definition, if it has one (a CompiledModel,
+    # or the train_ctrl of an A1.lighting_system, carry it).
+
+    def __init__(self, control_system, chunk_size=256, centroid='sampled', rule_index=True, fallback=None,
+                 share_subexpressions=True):
+        if centroid not in self.CENTROID_METHODS:
+            raise ValueError(f"Unknown centroid method: {centroid!r}")
+        self.chunk_size = chunk_size
+        self.centroid = centroid
+        self.rule_index = rule_index
+        self.telemetry = None
+        self.fallback = fallback if fallback is not None else getattr(control_system, 'fallback', None) or {}
+
+        self.antecedents = {var.label: var for var in control_system.antecedents}
+        self.consequents = {var.label: var for var in control_system.consequents}
+
+        # Each rule becomes (antecedent expression, [(output label, term label, weight), ...]);
+        # a CompiledModel (model_definition.py) already has its rules in this form
+        if hasattr(control_system, 'rule_table'):
+            self.rules = list(control_system.rule_table)
+        else:
+            self.rules = []
+            for rule in control_system.rules:
+                consequent = [(c.term.parent.label, c.term.label, c.weight) for c in rule.consequent]
+                self.rules.append((self._compile(rule.antecedent), consequent))
+        self.rule_terms = [sorted(self.terms_used(expression)) for expression, _ in self.rules]
+        self.index = SupportIndex(self.antecedents, [expression for expression, _ in self.rules], INPUT_LABELS)
+        self.dag = RuleDAG([expression for expression, _ in self.rules]) if share_subexpressions else None
+        # Element operations to fire one rule on its own for one reading: gathering its
+        # terms, then every AND/OR/NOT in its tree
+        self.rule_costs = np.array([len(terms) + tree_operations(expression)
+                                    for (expression, _), terms in zip(self.rules, self.rule_terms)])
+
+        # Corners of every input term: interpolating between these gives the same degrees
+        # as interpolating over the full sampled membership array, with far fewer points
+        self.input_corners = {}
+        for label, var in self.antecedents.items():
+            x = var.universe.astype(float)
+            self.input_corners[label] = {term_label: _breakpoints(x, term.mf) for term_label, term in var.terms.items()}
+
+        # Output terms used by at least one rule, in the order skfuzzy keeps them
+        self.output_terms = {}
+        for label, var in self.consequents.items():
+            used = {term for _, consequent in self.rules for out, term, _ in consequent if out == label}
+            self.output_terms[label] = [term for term in var.terms if term in used]
+
+        # Per output: index range where each term is non-zero, and the weights that turn a
+        # sampled membership array into its area and first moment (both are linear in it)
+        self.supports = {}
+        self.weights = {}
+        for label, var in self.consequents.items():
+            self.supports[label] = {}
+            for term_label, term in var.terms.items():
+                nonzero = np.flatnonzero(term.mf)
+                self.supports[label][term_label] = (nonzero.min(), nonzero.max() + 1) if len(nonzero) else (0, 0)
+            self.weights[label] = _integration_weights(var.universe.astype(float))
+
+        # Corners of every output term; the places where terms cross each other are worked
+        # out per set of active terms, on first use (see _crossings)
+        self.corners = {}
+        self.crossings = {}
+        for label, var in self.consequents.items():
+            x = var.universe.astype(float)
+            self.corners[label] = {term: _breakpoints(x, var.terms[term].mf) for term in self.output_terms[label]}
+
+    def _compile(self, antecedent):
+        # Turn skfuzzy's Term/TermAggregate tree into nested tuples
+        # (skfuzzy imports matplotlib, so it is only imported once a model is compiled)
+        from skfuzzy.control.term import Term, TermAggregate
+
+        if isinstance(antecedent, Term):
+            return ('term', antecedent.parent.label, antecedent.label)
+        if isinstance(antecedent, TermAggregate):
+            if antecedent.kind == 'not':
+                return ('not', self._compile(antecedent.term1))
+            return (antecedent.kind, self._compile(antecedent.term1), self._compile(antecedent.term2))
+        raise ValueError(f"Unexpected antecedent: {antecedent!r}")
+
+    def fuzzify(self, inputs):
+        # Membership degree of every input term, keyed by (variable, term)
+        memberships = {}
+        for i, label in enumerate(INPUT_LABELS):
+            memberships.update(self.fuzzify_variable(label, inputs[:, i]))
+        return memberships
+
+    def fuzzify_variable(self, label, values):
+        var = self.antecedents[label]
+        # skfuzzy clips out-of-range inputs to the universe, so do the same
+        values = np.clip(values, var.universe.min(), var.universe.max())
+        return {(label, term_label): np.interp(values, bx, by, left=0.0, right=0.0)
+                for term_label, (bx, by) in self.input_corners[label].items()}
+
+    def terms_used(self, expression):
+        # Every (variable, term) an antecedent expression reads
+        if expression[0] == 'term':
+            return {(expression[1], expression[2])}
+        return set().union(*(self.terms_used(part) for part in expression[1:]))
+
+    def _evaluate(self, expression, memberships):
+        kind = expression[0]
+        if kind == 'term':
+            return memberships[(expression[1], expression[2])]
+        if kind == 'not':
+            return 1.0 - self._evaluate(expression[1], memberships)
+        left = self._evaluate(expression[1], memberships)
+        right = self._evaluate(expression[2], memberships)
+        return np.fmin(left, right) if kind == 'and' else np.fmax(left, right)
+
+    def fire(self, memberships, candidates=None):
+        # Firing strength of every rule, shape (number of rules, N). With a candidates mask
+        # (N x rules, from SupportIndex) a rule is only evaluated for the readings where it
+        # can fire and left at zero everywhere else. With a shared rule graph, the rules go
+        # through it instead whenever that looks cheaper; the strengths are the same.
+        if self.dag is not None:
+            if candidates is None:
+                return self.dag.evaluate(memberships)
+            # Readings without a candidate come out as zero either way (candidates never
+            # miss a firing rule), so only leave them out when that saves much: writing
+            # the strengths back costs about as much as evaluating them
+            rows = np.flatnonzero(candidates.any(axis=1))
+            whole = len(rows) * 2 > len(candidates)
+            if self._shared_is_cheaper(candidates, len(candidates) if whole else len(rows)):
+                if whole:
+                    return self.dag.evaluate(memberships)
+                strengths = np.zeros((len(self.rules), len(candidates)))
+                strengths[:, rows] = self.dag.evaluate({key: memberships[key][rows] for key in self.dag.terms})
+                return strengths
+        elif candidates is None:
+            return np.array([self.fire_rule(i, memberships) for i in range(len(self.rules))])
+
+        n = len(candidates)
+        strengths = np.zeros((len(self.rules), n))
+        rules, rows = np.nonzero(candidates.T)
+        splits = np.flatnonzero(np.diff(rules)) + 1
+        for rule, rule_rows in zip(rules[np.r_[0, splits]] if len(rules) else [], np.split(rows, splits)):
+            if len(rule_rows) == n:
+                strengths[rule] = self.fire_rule(rule, memberships)
+            else:
+                subset = {key: memberships[key][rule_rows] for key in self.rule_terms[rule]}
+                strengths[rule, rule_rows] = self.fire_rule(rule, subset)
+        return strengths
+
+    def _shared_is_cheaper(self, candidates, rows):
+        # Estimated cost of the shared graph over `rows` readings, against firing each
+        # candidate rule on its own readings. Few candidates (single readings, or a large
+        # rule base) favour the latter.
+        if not rows:
+            return False
+        shared = (self.dag.operations() + len(self.dag.terms)) * (rows + CALL_COST)
+        separate = (CALL_COST * (self.rule_costs @ candidates.any(axis=0))
+                    + GATHER_COST * self.rule_costs.mean() * np.count_nonzero(candidates))
+        return shared <= separate
+
+    def _index_pays(self, n):
+        # Whether looking up candidates for n readings is estimated to save more than it
+        # costs. Picking candidate readings out of the membership arrays costs more per
+        # element than evaluating the rules on all of them, so what the index saves is the
+        # per-call cost of the rules that can't fire; once the lookup itself costs more
+        # than that (large batches, small rule bases) it only slows the batch down.
+        lookup = len(INPUT_LABELS) * (LOOKUP_COST * n + 6 * CALL_COST) + len(self.rules) * n
+        calls = self.dag.operations() + len(self.dag.terms) if self.dag is not None else self.rule_costs.sum()
+        return lookup < calls * CALL_COST
+
+    def fire_rule(self, index, memberships):
+        return self._evaluate(self.rules[index][0], memberships)
+
+    def aggregate(self, strengths, active=None):
+        # Cut level of every output term: max activation over the rules that use it.
+        # Activations are never negative, so rules known to be idle (active[rule] False)
+        # can be skipped without changing any cut.
+        n = strengths.shape[1]
+        cuts = {label: {term: np.zeros(n) for term in terms} for label, terms in self.output_terms.items()}
+        for rule, ((_, consequent), strength) in enumerate(zip(self.rules, strengths)):
+            if active is not None and not active[rule]:
+                continue
+            for out, term, weight in consequent:
+                np.fmax(cuts[out][term], strength * weight, out=cuts[out][term])
+        return cuts
+
+    def defuzzify(self, label, cuts):
+        # Centroid of the clipped and max-aggregated output sets. Usually only one or two
+        # terms have a non-zero cut, so readings are grouped by which terms are active and
+        # each group is integrated over its active terms only, a chunk at a time.
+        terms = list(cuts)
+        active = np.column_stack([cuts[term] > 0 for term in terms])
+        patterns = active @ (1 << np.arange(len(terms)))
+        order = np.argsort(patterns, kind='stable')
+        groups = np.split(order, np.flatnonzero(np.diff(patterns[order])) + 1)
+
+        # No rule fired for a reading -> nothing to defuzzify, report NaN
+        result = np.full(len(patterns), np.nan)
+        integrate = self._integrate_breakpoints if self.centroid == 'breakpoints' else self._integrate_sampled
+        for group in groups:
+            used = [term for term, on in zip(terms, active[group[0]]) if on] if len(group) else []
+            if not used:
+                continue
+            for start in range(0, len(group), self.chunk_size):
+                rows = group[start:start + self.chunk_size]
+                area, moment = integrate(label, {term: cuts[term][rows] for term in used})
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result[rows] = np.where(area > 0, moment / area, np.nan)
+
+        return result
+
+    def _integrate_sampled(self, label, cuts):
+        # Area and first moment of the aggregated shape, built on every sample of the universe
+        var = self.consequents[label]
+        shape = np.zeros((len(next(iter(cuts.values()))), len(var.universe)))
+        for term, cut in cuts.items():
+            lo, hi = self.supports[label][term]
+            clipped = np.minimum(cut[:, None], var.terms[term].mf[None, lo:hi])
+            np.maximum(shape[:, lo:hi], clipped, out=shape[:, lo:hi])
+        return (shape @ self.weights[label]).T
+
+    def _integrate_breakpoints(self, label, cuts):
+        # Same integrals, from the points where the aggregated shape can bend:
+        # the terms' corners and crossings, plus where each term meets every cut level
+        var = self.consequents[label]
+        lo, hi = float(var.universe.min()), float(var.universe.max())
+        terms = list(cuts)
+        levels = np.column_stack([cuts[term] for term in terms])
+
+        crossings = self._crossings(label, tuple(terms))
+        points = [np.broadcast_to(crossings, (len(levels), len(crossings)))]
+        for term in terms:
+            points.append(_level_crossings(*self.corners[label][term], levels))
+        x = np.sort(np.clip(np.hstack(points), lo, hi), axis=1)
+
+        y = np.zeros_like(x)
+        for i, term in enumerate(terms):
+            bx, by = self.corners[label][term]
+            membership = np.interp(x, bx, by, left=0.0, right=0.0)
+            np.maximum(y, np.minimum(membership, levels[:, i:i + 1]), out=y)
+
+        # The shape is linear between consecutive points, so integrate each piece exactly
+        x1, x2, y1, y2 = x[:, :-1], x[:, 1:], y[:, :-1], y[:, 1:]
+        dx = x2 - x1
+        area = (dx * (y1 + y2) / 2).sum(axis=1)
+        moment = (dx / 6 * (x1 * (2 * y1 + y2) + x2 * (y1 + 2 * y2))).sum(axis=1)
+        return area, moment
+
+    def _crossings(self, label, terms):
+        # Universe ends, corners of the given terms and the points where any two of them cross
+        key = (label, terms)
+        if key not in self.crossings:
+            x = self.consequents[label].universe.astype(float)
+            corners = [self.corners[label][term] for term in terms]
+            points = [x[[0, -1]]] + [bx for bx, _ in corners]
+            for i, first in enumerate(corners):
+                for second in corners[i + 1:]:
+                    points.append(_intersections(first, second))
+            self.crossings[key] = np.unique(np.concatenate(points))
+        return self.crossings[key]
+
+    def compute(self, inputs, with_fired=False):
+        # (brightness, colour temperature); with_fired=True adds a boolean mask of the
+        # readings where at least one rule fired, which NaN can't tell once a fallback is set
+        inputs = np.asarray(inputs, dtype=float).reshape(-1, len(INPUT_LABELS))
+        # Optional per-stage timing and rule-firing counters (see telemetry.py);
+        # when none is attached this costs one check per stage
+        telemetry = self.telemetry
+        start = time.perf_counter() if telemetry else None
+
+        memberships = self.fuzzify(inputs)
+        if telemetry:
+            start = telemetry.stage('fuzzification', start)
+
+        candidates = self.index.candidates(inputs) if self.rule_index and self._index_pays(len(inputs)) else None
+        strengths = self.fire(memberships, candidates)
+        if telemetry:
+            telemetry.record_firing(strengths)
+            start = telemetry.stage('rule evaluation', start)
+
+        # Readings where no rule fired come out as NaN anyway; leave them out of the
+        # last two stages, which cost the most per reading
+        fired = strengths.any(axis=0)
+        if not fired.all():
+            strengths = strengths[:, fired]
+
+        cuts = self.aggregate(strengths, None if candidates is None else candidates.any(axis=0))
+        if telemetry:
+            start = telemetry.stage('aggregation', start)
+
+        brightness = np.full(len(inputs), np.nan)
+        colour_temp = np.full(len(inputs), np.nan)
+        if strengths.shape[1]:
+            brightness[fired] = self.defuzzify('brightness', cuts['brightness'])
+            colour_temp[fired] = self.defuzzify('colour temperature', cuts['colour temperature'])
+        self.apply_fallback(brightness, colour_temp)
+        if telemetry:
+            telemetry.stage('defuzzification', start)
+        return (brightness, colour_temp, fired) if with_fired else (brightness, colour_temp)
+
+    def apply_fallback(self, brightness, colour_temp):
+        # Readings where no rule fired (NaN) get the fallback outputs, in place; anything
+        # that defuzzifies on its own (e.g. IncrementalEvaluator) goes through here too
+        for label, values in (('brightness', brightness), ('colour temperature', colour_temp)):
+            if label in self.fallback:
+                values[np.isnan(values)] = self.fallback[label]
+        return brightness, colour_temp
+
+
+def _integration_weights(x):
+    # Exact area and first moment of a piecewise-linear function sampled at x are
+    # sums of its samples times these weights (one column each)
+    dx = np.diff(x)
+    weights = np.zeros((len(x), 2))
+    weights[:-1, 0] += dx / 2
+    weights[1:, 0] += dx / 2
+    weights[:-1, 1] += dx / 6 * (2 * x[:-1] + x[1:])
+    weights[1:, 1] += dx / 6 * (x[:-1] + 2 * x[1:])
+    return weights
+
+
+def _breakpoints(x, mf):
+    # Corners of a sampled piecewise-linear membership function: the ends of the
+    # universe and every sample where the slope changes
+    slopes = np.diff(mf) / np.diff(x)
+    bends = np.flatnonzero(~np.isclose(slopes[1:], slopes[:-1], rtol=0, atol=1e-9)) + 1
+    index = np.concatenate([[0], bends, [len(x) - 1]])
+    return x[index], np.asarray(mf, dtype=float)[index]
+
+
+def _segments(bx, by):
+    return bx[:-1], bx[1:], by[:-1], by[1:]
+
+
+def _intersections(first, second):
+    # x positions where two piecewise-linear functions cross
+    ax1, ax2, ay1, ay2 = (v[:, None] for v in _segments(*first))
+    bx1, bx2, by1, by2 = (v[None, :] for v in _segments(*second))
+    start, stop = np.maximum(ax1, bx1), np.minimum(ax2, bx2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sa = (ay2 - ay1) / (ax2 - ax1)
+        sb = (by2 - by1) / (bx2 - bx1)
+        x = (by1 - ay1 + sa * ax1 - sb * bx1) / (sa - sb)
+    valid = (start < stop) & np.isfinite(x) & (x >= start) & (x <= stop)
+    return x[valid]
+
+
+def _level_crossings(bx, by, levels):
+    # x positions where a piecewise-linear function reaches each level, shape
+    # (readings, segments x levels); segments that never reach a level give their start
+    x1, x2, y1, y2 = (v[None, :, None] for v in _segments(bx, by))
+    levels = levels[:, None, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = x1 + (levels - y1) * (x2 - x1) / (y2 - y1)
+    valid = np.isfinite(x) & (x >= x1) & (x <= x2)
+    return np.where(valid, x, x1).reshape(len(levels), -1)
+
+
+def random_inputs(n, seed=0):
+    # Uniform readings over the same ranges get_float_input accepts
+    rng = np.random.default_rng(seed)
+    return rng.uniform(INPUT_BOUNDS[:, 0], INPUT_BOUNDS[:, 1], size=(n, len(INPUT_LABELS)))
+
+
+def simulate(simulation, inputs):
+    # Reference results: one train.compute() call per reading, NaN when no rule fired
+    brightness = np.full(len(inputs), np.nan)
+    colour_temp = np.full(len(inputs), np.nan)
+    for i, row in enumerate(inputs):
+        for label, value in zip(INPUT_LABELS, row):
+            simulation.input[label] = value
+        simulation.compute()
+        brightness[i] = simulation.output.get('brightness', np.nan)
+        colour_temp[i] = simulation.output.get('colour temperature', np.nan)
+    return brightness, colour_temp
+
+
+def max_difference(expected, actual):
+    # Largest absolute difference; a NaN on only one side counts as infinite
+    expected, actual = np.asarray(expected), np.asarray(actual)
+    if np.any(np.isnan(expected) != np.isnan(actual)):
+        return float('inf')
+    both = ~np.isnan(expected)
+    return float(np.abs(expected[both] - actual[both]).max(initial=0.0))
+
+
+def main():
+    import A1
+
+    # Readings around the ones the rule base was written for, plus uniform noise
+    inputs = np.vstack([random_inputs(200, seed=1),
+                        [[90, 15, 200, 150, 750, 12], [90, 15, 200, 150, 750, 21], [25, 10, 700, 400, 1500, 6]]])
+
+    start = time.perf_counter()
+    expected = simulate(A1.train, inputs)
+    loop_time = (time.perf_counter() - start) / len(inputs)
+
+    print(f"train.compute() loop: {loop_time * 1e6:.1f} us/reading")
+
+    big = random_inputs(20000, seed=2)
+    for centroid in BatchEngine.CENTROID_METHODS:
+        engine = BatchEngine(A1.train_ctrl, centroid=centroid)
+
+        actual = engine.compute(inputs)
+        for label, e, a in zip(OUTPUT_LABELS, expected, actual):
+            diff = max_difference(e, a)
+            status = "OK" if diff <= TOLERANCE else "MISMATCH"
+            print(f"  [{centroid}] {label}: max difference {diff:.6f} (tolerance {TOLERANCE}) {status}")
+
+        start = time.perf_counter()
+        engine.compute(big)
+        batch_time = (time.perf_counter() - start) / len(big)
+        print(f"  [{centroid}] batch engine: {batch_time * 1e6:.1f} us/reading ({loop_time / batch_time:.0f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import A1
+from batch_engine import INPUT_LABELS, BatchEngine, random_inputs, simulate
+from startup_budget import measure as measure_startup
+
+# Readings the single-call benchmarks use: scenarios from A1.py where rules fire
+SAMPLE_READINGS = np.array([
+    [90, 15, 200, 150, 750, 12],
+    [90, 15, 200, 150, 750, 21],
+    [25, 10, 700, 400, 1500, 6],
+    [160, 30, 700, 100, 1500, 19],
+    [180, 20, 100, 50, 2000, 20],
+], dtype=float)
+
+# How much worse than the baseline a result may get before compare mode flags it
+DEFAULT_THRESHOLD = 0.25
+
+
+def timed(function, repeats):
+    # Median wall time of several runs, after one warm-up run
+    function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def result(value, unit, lower_is_better=True):
+    return {'value': value, 'unit': unit, 'lower_is_better': lower_is_better}
+
+
+def bench_single_compute(repeats):
+    from skfuzzy import control as ctrl
+
+    # skfuzzy would otherwise answer the repeated readings from its own cache
+    train = ctrl.ControlSystemSimulation(A1.lighting_system().train_ctrl, cache=False)
+    inputs = np.repeat(SAMPLE_READINGS, 4, axis=0)
+    seconds = timed(lambda: simulate(train, inputs), repeats) / len(inputs)
+    return {'train.compute() latency': result(seconds * 1e3, 'ms')}
+
+
+def bench_batch(sizes, repeats):
+    results = {}
+    for centroid in BatchEngine.CENTROID_METHODS:
+        engine = BatchEngine(A1.lighting_system().train_ctrl, centroid=centroid)
+        for size in sizes:
+            inputs = random_inputs(size, seed=size)
+            seconds = timed(lambda: engine.compute(inputs), repeats)
+            results[f'batch throughput ({centroid}, {size})'] = result(size / seconds, 'readings/s', False)
+    return results
+
+
+def bench_sweep(resolution):
+    # The grid loop behind show_3d_graph; 100 x 100 is what the menu runs
+    start = time.perf_counter()
+    A1.control_surface_grid('ambient light', 'time of day', resolution)
+    seconds = time.perf_counter() - start
+    return {f'show_3d_graph sweep ({resolution}x{resolution})': result(seconds, 's')}
+
+
+def bench_startup():
+    return {f'startup: {step}': result(seconds * 1e3, 'ms') for step, seconds in measure_startup().items()}
+
+
+def bench_memory(step_scales):
+    # Peak traced memory (numpy buffers included) to build the model at a given universe
+    # step and run one reading through train.compute() and one batch through the engine
+    results = {}
+    for step_scale in step_scales:
+        A1.lighting_system.cache_clear()
+        tracemalloc.start()
+        system = A1.lighting_system(step_scale)
+        simulate(system.train, SAMPLE_READINGS[:1])
+        BatchEngine(system.train_ctrl).compute(random_inputs(256))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[f'peak memory (brightness step {step_scale:g} lm)'] = result(peak / 2 ** 20, 'MiB')
+    A1.lighting_system.cache_clear()
+    return results
+
+
+def run(full=False):
+    # full=True uses the 100 x 100 sweep show_3d_graph runs and larger batches
+    repeats = 5
+    results = {}
+    results.update(bench_single_compute(repeats))
+    results.update(bench_batch([1, 100, 10000] + ([100000] if full else []), repeats))
+    results.update(bench_sweep(100 if full else 10))
+    skipped = {}
+    try:
+        results.update(bench_startup())
+    except subprocess.CalledProcessError as error:
+        # Startup is timed in fresh interpreters; if those can't run, say so and carry on
+        skipped['startup'] = (error.stderr or str(error)).strip().splitlines()[-1]
+    results.update(bench_memory([10, 1, 0.5]))
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'full': full,
+            'inputs': INPUT_LABELS,
+            'skipped': skipped,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    # Benchmarks that got worse than the baseline by more than threshold (a fraction)
+    regressions = []
+    for name, new in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None or old['value'] == 0:
+            continue
+        change = (new['value'] - old['value']) / old['value']
+        worse = change if new['lower_is_better'] else -change
+        if worse > threshold:
+            regressions.append((name, old['value'], new['value'], new['unit'], worse))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the street lighting controller.")
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', metavar='BASELINE', help="flag regressions against a stored results file")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"allowed slowdown before flagging, as a fraction (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument('--full', action='store_true', help="run the full 100x100 sweep and larger batches")
+    args = parser.parse_args()
+
+    current = run(args.full)
+    for name, entry in current['results'].items():
+        print(f"{name:<48} {entry['value']:14.3f} {entry['unit']}")
+    for name, reason in current['meta']['skipped'].items():
+        print(f"{name + ' benchmarks':<48} {'unavailable':>14} ({reason})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        for name, old, new, unit, worse in regressions:
+            print(f"REGRESSION {name}: {old:.3f} -> {new:.3f} {unit} ({worse:+.0%})")
+        if not regressions:
+            print(f"No regressions against {args.compare}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
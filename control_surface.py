@@ -0,0 +1,157 @@
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+
+from batch_engine import INPUT_BOUNDS, INPUT_LABELS, OUTPUT_LABELS, BatchEngine, random_inputs, simulate
+
+# Grid points per input, in INPUT_LABELS order (about 4 million points, 32 MB on disk)
+DEFAULT_SHAPE = (11, 12, 10, 11, 11, 25)
+
+# File names inside a surface directory
+OUTPUT_FILES = {'brightness': 'brightness.npy', 'colour temperature': 'colour_temperature.npy'}
+FIRED_FILE = 'fired.npy'
+AXES_FILE = 'axes.npz'
+
+
+def grid_axes(shape):
+    # Evenly spaced grid points over the full range of each input
+    if len(shape) != len(INPUT_LABELS) or min(shape) < 2:
+        raise ValueError(f"Need at least 2 grid points for each of the {len(INPUT_LABELS)} inputs, got {shape}")
+    return [np.linspace(lo, hi, n) for (lo, hi), n in zip(INPUT_BOUNDS, shape)]
+
+
+def build_surface(engine, directory, shape=DEFAULT_SHAPE, chunk_size=65536):
+    # Evaluate the rule base on every grid point and write one .npy table per output, plus
+    # one marking the points where a rule fired. Tables are written through memory maps a
+    # chunk at a time, so the grid never has to fit in memory. Readings where no rule fires
+    # are stored as NaN (or the engine's fallback).
+    shape = tuple(int(n) for n in shape)
+    axes = grid_axes(shape)
+    os.makedirs(directory, exist_ok=True)
+    np.savez(os.path.join(directory, AXES_FILE), *axes)
+
+    tables = {label: np.lib.format.open_memmap(os.path.join(directory, OUTPUT_FILES[label]),
+                                               mode='w+', dtype=np.float32, shape=shape)
+              for label in OUTPUT_LABELS}
+    fired_table = np.lib.format.open_memmap(os.path.join(directory, FIRED_FILE), mode='w+', dtype=bool, shape=shape)
+
+    total = int(np.prod(shape))
+    for start in range(0, total, chunk_size):
+        stop = min(start + chunk_size, total)
+        index = np.unravel_index(np.arange(start, stop), shape)
+        inputs = np.column_stack([axis[i] for axis, i in zip(axes, index)])
+        *outputs, fired = engine.compute(inputs, with_fired=True)
+        for label, values in zip(OUTPUT_LABELS, outputs):
+            tables[label].reshape(-1)[start:stop] = values
+        fired_table.reshape(-1)[start:stop] = fired
+
+    for table in [*tables.values(), fired_table]:
+        table.flush()
+    return ControlSurface(directory)
+
+
+class ControlSurface:
+    # Answers batches of readings by multilinear interpolation between grid points,
+    # reading the tables straight from the memory-mapped .npy files. Only the corners of a
+    # cell where a rule fired are interpolated between (their weights renormalised), so a
+    # reading next to an uncovered region still gets an answer; a reading whose corners
+    # all fired no rule gets what the tables hold there (NaN, or the fallback).
+
+    def __init__(self, directory):
+        with np.load(os.path.join(directory, AXES_FILE)) as axes:
+            self.axes = [axes[f'arr_{i}'] for i in range(len(INPUT_LABELS))]
+        self.shape = tuple(len(axis) for axis in self.axes)
+        self.tables = {label: np.load(os.path.join(directory, OUTPUT_FILES[label]), mmap_mode='r')
+                       for label in OUTPUT_LABELS}
+        # Surfaces built before the fired table existed had no fallback, so NaN tells
+        fired_path = os.path.join(directory, FIRED_FILE)
+        self.fired = np.load(fired_path, mmap_mode='r') if os.path.exists(fired_path) else None
+
+    def nbytes(self):
+        return sum(table.nbytes for table in self.tables.values())
+
+    def query(self, inputs):
+        inputs = np.asarray(inputs, dtype=float).reshape(-1, len(INPUT_LABELS))
+
+        # Lower grid index and position inside the grid cell for every input
+        lower, fraction = [], []
+        for d, axis in enumerate(self.axes):
+            values = np.clip(inputs[:, d], axis[0], axis[-1])
+            i = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, len(axis) - 2)
+            lower.append(i)
+            fraction.append((values - axis[i]) / (axis[i + 1] - axis[i]))
+
+        # Weighted sums over the corners that fired, and over all of them for cells where none did
+        fired_sums = {label: np.zeros(len(inputs)) for label in OUTPUT_LABELS}
+        all_sums = {label: np.zeros(len(inputs)) for label in OUTPUT_LABELS}
+        fired_weight = np.zeros(len(inputs))
+        for corner in itertools.product((0, 1), repeat=len(self.axes)):
+            weight = np.ones(len(inputs))
+            for offset, t in zip(corner, fraction):
+                weight *= t if offset else 1 - t
+            flat = np.ravel_multi_index([i + offset for i, offset in zip(lower, corner)], self.shape)
+            values = {label: table.reshape(-1)[flat] for label, table in self.tables.items()}
+            fired = self.fired.reshape(-1)[flat] if self.fired is not None else ~np.isnan(values['brightness'])
+            fired &= weight > 0
+            fired_weight += np.where(fired, weight, 0.0)
+            for label, corner_values in values.items():
+                fired_sums[label] += np.where(fired, weight * corner_values, 0.0)
+                # Corners with zero weight must not drag a NaN (no rule fired) into the result
+                all_sums[label] += np.where(weight > 0, weight * corner_values, 0.0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return tuple(np.where(fired_weight > 0, fired_sums[label] / fired_weight, all_sums[label])
+                         for label in OUTPUT_LABELS)
+
+
+def interpolation_error(surface, simulation, inputs):
+    # Maximum difference between the surface and train.compute() over the given readings.
+    # A reading only one side has an answer for (rule coverage edges) counts as that answer
+    # against 0, a dark lamp, the way show_3d_graph draws it; how many of those there were
+    # is reported as well.
+    expected = simulate(simulation, inputs)
+    actual = surface.query(inputs)
+    report = {}
+    for label, e, a in zip(OUTPUT_LABELS, expected, actual):
+        report[label] = float(np.abs(np.nan_to_num(e, nan=0.0) - np.nan_to_num(a, nan=0.0)).max(initial=0.0))
+    report['coverage mismatches'] = int(np.sum(np.isnan(expected[0]) != np.isnan(actual[0])))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the precomputed street lighting control surface.")
+    parser.add_argument('directory', help="directory holding the surface tables")
+    parser.add_argument('--build', action='store_true', help="evaluate the rule base on the grid and write the tables")
+    parser.add_argument('--shape', type=int, nargs=len(INPUT_LABELS), default=DEFAULT_SHAPE,
+                        help="grid points per input (ambient light, distance, traffic, pedestrians, visibility, time)")
+    parser.add_argument('--check', type=int, default=200, metavar='N',
+                        help="compare N random readings against train.compute() (0 to skip)")
+    args = parser.parse_args()
+
+    import A1
+
+    if args.build:
+        start = time.perf_counter()
+        surface = build_surface(BatchEngine(A1.train_ctrl, centroid='breakpoints'), args.directory, args.shape)
+        print(f"Built {surface.shape} surface ({surface.nbytes() / 1e6:.1f} MB) in {time.perf_counter() - start:.1f} s")
+    else:
+        surface = ControlSurface(args.directory)
+
+    queries = random_inputs(100000, seed=3)
+    start = time.perf_counter()
+    surface.query(queries)
+    print(f"Lookup: {(time.perf_counter() - start) / len(queries) * 1e6:.2f} us/reading")
+
+    if args.check:
+        report = interpolation_error(surface, A1.train, random_inputs(args.check, seed=4))
+        for label in OUTPUT_LABELS:
+            print(f"Max interpolation error ({label}): {report[label]:.1f}")
+        print(f"Readings where only one side found a firing rule: {report['coverage mismatches']} "
+              f"(counted in the errors above)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import collections
+import time
+
+import numpy as np
+
+from batch_engine import INPUT_LABELS, BatchEngine
+from model_definition import load_model
+
+# Inputs that change over the day; distance is fixed per lamp and time of day comes from the clock
+TRACE_LABELS = ['ambient light', 'traffic activity', 'pedestrian activity', 'visibility']
+
+# brightness, colour_temp: (lamps, steps) float32, or None when series=False
+# lumen_hours: (lamps,) light delivered over the day; unlit_steps: (lamps,) steps where no rule fired
+FleetDay = collections.namedtuple('FleetDay', 'brightness colour_temp lumen_hours unlit_steps')
+
+
+def simulate_fleet(engine, distance, traces, hours, chunk_readings=2 ** 18, series=True):
+    # Evaluate every lamp at every time step in batches of about chunk_readings readings.
+    #   engine:   anything with compute(inputs, with_fired=True) like BatchEngine's, e.g. a
+    #             BatchEngine, ShardedEngine or CachedController
+    #   distance: (lamps,)
+    #   traces:   {label: (lamps, steps) or (steps,) if every lamp sees the same} for each
+    #             of TRACE_LABELS; np.memmap arrays work, only one chunk of rows is read at a time
+    #   hours:    (steps,) time of day of each step, increasing, within one day
+    # A step's output holds until the next step (the last one until the same time the next
+    # day). Steps where no rule fired give the model's fallback brightness, or no light
+    # without one, and are counted in unlit_steps either way.
+    distance = np.asarray(distance, dtype=float)
+    hours = np.asarray(hours, dtype=float)
+    n_lamps, n_steps = len(distance), len(hours)
+    durations = np.diff(hours, append=hours[0] + 24)
+
+    brightness = np.empty((n_lamps, n_steps), dtype=np.float32) if series else None
+    colour_temp = np.empty((n_lamps, n_steps), dtype=np.float32) if series else None
+    lumen_hours = np.zeros(n_lamps)
+    unlit_steps = np.zeros(n_lamps, dtype=np.int64)
+
+    lamps_per_chunk = max(1, chunk_readings // n_steps)
+    inputs = np.empty((lamps_per_chunk * n_steps, len(INPUT_LABELS)))
+    for lo in range(0, n_lamps, lamps_per_chunk):
+        hi = min(lo + lamps_per_chunk, n_lamps)
+        block = inputs[:(hi - lo) * n_steps].reshape(hi - lo, n_steps, len(INPUT_LABELS))
+        block[:, :, INPUT_LABELS.index('distance')] = distance[lo:hi, None]
+        block[:, :, INPUT_LABELS.index('time of day')] = hours
+        for label in TRACE_LABELS:
+            trace = traces[label]
+            block[:, :, INPUT_LABELS.index(label)] = trace[lo:hi] if np.ndim(trace) == 2 else trace
+
+        chunk_brightness, chunk_colour, fired = (
+            output.reshape(hi - lo, n_steps)
+            for output in engine.compute(block.reshape(-1, len(INPUT_LABELS)), with_fired=True))
+        lumen_hours[lo:hi] = np.nan_to_num(chunk_brightness, nan=0.0) @ durations
+        unlit_steps[lo:hi] = n_steps - fired.sum(axis=1)
+        if series:
+            brightness[lo:hi] = chunk_brightness
+            colour_temp[lo:hi] = chunk_colour
+
+    return FleetDay(brightness, colour_temp, lumen_hours, unlit_steps)
+
+
+def synthetic_fleet(n_lamps, hours, seed=0):
+    # A made-up district: lamps on roads of different sizes, daylight with per-lamp shade
+    # and light spill at night, commuter peaks in traffic and pedestrians, and morning fog
+    rng = np.random.default_rng(seed)
+    h = hours[None, :]
+
+    distance = rng.uniform(2, 60, n_lamps)
+    road = rng.uniform(0.1, 1, (n_lamps, 1))
+    shade = rng.uniform(0.6, 1, (n_lamps, 1))
+    spill = rng.uniform(5, 40, (n_lamps, 1))
+    clear_air = rng.uniform(900, 2400, (n_lamps, 1))
+
+    daylight = 200 * np.clip(np.sin(np.pi * (h - 6) / 12), 0, 1) ** 0.5
+    rush = np.exp(-(h - 8) ** 2 / 2) + np.exp(-(h - 17.5) ** 2 / 3)
+    daytime = np.clip(np.sin(np.pi * (h - 5) / 17), 0, 1)
+    fog = np.exp(-(h - 5) ** 2 / 4)
+
+    def noisy(mean, scale, lo, hi):
+        return np.clip(mean + rng.normal(0, scale, (n_lamps, len(hours))), lo, hi).astype(np.float32)
+
+    traces = {
+        'ambient light': noisy(np.maximum(daylight * shade, spill), 3, 0, 200),
+        'traffic activity': noisy(road * (60 + 350 * daytime + 550 * rush), 30, 0, 900),
+        'pedestrian activity': noisy((1.2 - road) * (20 + 180 * daytime + 250 * rush), 15, 0, 500),
+        'visibility': noisy(clear_air * (1 - 0.8 * fog), 40, 0, 2500),
+    }
+    return distance, traces
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a day of the whole lamp fleet and total the light delivered.")
+    parser.add_argument('--lamps', type=int, default=10000, help="number of lamps (default: 10000)")
+    parser.add_argument('--step-minutes', type=float, default=1, help="simulation time step (default: 1)")
+    parser.add_argument('--workers', type=int, default=1, help="worker processes (default: 1, in-process)")
+    parser.add_argument('--chunk-readings', type=int, default=2 ** 18, help="readings evaluated at once")
+    parser.add_argument('--efficacy', type=float, default=120, help="LED efficacy in lm/W, for the energy total")
+    parser.add_argument('--model', help="model definition file (default: lighting_model.json)")
+    parser.add_argument('-o', '--output', help="save the time series and per-lamp totals to this .npz file")
+    args = parser.parse_args()
+
+    hours = np.arange(0, 24, args.step_minutes / 60)
+    distance, traces = synthetic_fleet(args.lamps, hours, seed=15)
+
+    if args.workers > 1:
+        from parallel_engine import ShardedEngine
+
+        engine = ShardedEngine(args.workers, model=args.model)
+        engine.warm_up()
+    else:
+        engine = BatchEngine(load_model(args.model), centroid='breakpoints')
+
+    start = time.perf_counter()
+    try:
+        day = simulate_fleet(engine, distance, traces, hours, args.chunk_readings, series=bool(args.output))
+    finally:
+        if args.workers > 1:
+            engine.close()
+    elapsed = time.perf_counter() - start
+
+    readings = args.lamps * len(hours)
+    print(f"{args.lamps} lamps x {len(hours)} steps = {readings} readings in {elapsed:.1f} s "
+          f"({readings / elapsed:.0f} readings/s)")
+    print(f"light delivered: {day.lumen_hours.sum() / 1e6:.1f} million lumen-hours "
+          f"(~{day.lumen_hours.sum() / args.efficacy / 1000:.0f} kWh at {args.efficacy:g} lm/W)")
+    print(f"per lamp: mean {day.lumen_hours.mean():.0f} lm·h, max {day.lumen_hours.max():.0f} lm·h; "
+          f"{day.unlit_steps.sum() / readings:.1%} of steps with no rule fired")
+
+    if args.output:
+        np.savez(args.output, hours=hours, distance=distance, brightness=day.brightness,
+                 colour_temp=day.colour_temp, lumen_hours=day.lumen_hours, unlit_steps=day.unlit_steps)
+
+
+if __name__ == '__main__':
+    main()
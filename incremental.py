@@ -0,0 +1,115 @@
+import time
+
+import numpy as np
+
+from batch_engine import INPUT_LABELS, BatchEngine, random_inputs
+
+
+class IncrementalEvaluator:
+    # Keeps the last inputs, membership degrees, rule strengths and outputs of every lamp
+    # in a fleet. A tick only refuzzifies the inputs that changed, refires the rules that
+    # read those inputs and re-defuzzifies the lamps whose rule strengths moved; every
+    # other lamp keeps its previous output.
+
+    def __init__(self, engine, n_lamps):
+        self.engine = engine
+        self.n_lamps = n_lamps
+        self.inputs = None
+        self.memberships = None
+        self.strengths = None
+        self.outputs = None
+
+        # Terms each rule reads, and which input columns they come from
+        self.rule_terms = engine.rule_terms
+        self.rule_columns = [sorted({INPUT_LABELS.index(label) for label, _ in terms}) for terms in self.rule_terms]
+
+    def reset(self, inputs):
+        # Full evaluation; becomes the state later ticks are compared against
+        self.inputs = inputs.copy()
+        self.memberships = self.engine.fuzzify(inputs)
+        self.strengths = self.engine.fire(self.memberships)
+        self.outputs = np.column_stack(self._defuzzify(self.strengths))
+        return self.outputs[:, 0].copy(), self.outputs[:, 1].copy()
+
+    def tick(self, inputs):
+        inputs = np.asarray(inputs, dtype=float).reshape(self.n_lamps, len(INPUT_LABELS))
+        if self.inputs is None:
+            return self.reset(inputs)
+
+        changed = inputs != self.inputs
+        if not changed.any():
+            return self.outputs[:, 0].copy(), self.outputs[:, 1].copy()
+
+        # Refuzzify only the (lamp, variable) pairs whose value moved
+        for column, label in enumerate(INPUT_LABELS):
+            lamps = np.flatnonzero(changed[:, column])
+            if len(lamps):
+                for key, values in self.engine.fuzzify_variable(label, inputs[lamps, column]).items():
+                    self.memberships[key][lamps] = values
+
+        # Refire only the rules reading a changed variable, for the lamps where it changed
+        moved = np.zeros(self.n_lamps, dtype=bool)
+        for rule, (terms, columns) in enumerate(zip(self.rule_terms, self.rule_columns)):
+            lamps = np.flatnonzero(changed[:, columns].any(axis=1))
+            if len(lamps):
+                subset = {key: self.memberships[key][lamps] for key in terms}
+                strengths = self.engine.fire_rule(rule, subset)
+                moved[lamps] |= strengths != self.strengths[rule, lamps]
+                self.strengths[rule, lamps] = strengths
+
+        # Only lamps whose rule strengths actually moved need a new centroid
+        lamps = np.flatnonzero(moved)
+        if len(lamps):
+            self.outputs[lamps] = np.column_stack(self._defuzzify(self.strengths[:, lamps]))
+
+        self.inputs = inputs.copy()
+        return self.outputs[:, 0].copy(), self.outputs[:, 1].copy()
+
+    def _defuzzify(self, strengths):
+        cuts = self.engine.aggregate(strengths)
+        return self.engine.apply_fallback(self.engine.defuzzify('brightness', cuts['brightness']),
+                                          self.engine.defuzzify('colour temperature', cuts['colour temperature']))
+
+
+def main():
+    import A1
+
+    n_lamps, ticks = 20000, 20
+    # With a fallback too: lamps where no rule fires must get it on the incremental path as well
+    for fallback in (None, {'brightness': 0.0, 'colour temperature': 2700.0}):
+        engine = BatchEngine(A1.train_ctrl, centroid='breakpoints', fallback=fallback)
+        rng = np.random.default_rng(9)
+        readings = random_inputs(n_lamps, seed=10)
+        evaluator = IncrementalEvaluator(engine, n_lamps)
+        evaluator.tick(readings)
+
+        full_time = incremental_time = 0.0
+        for _ in range(ticks):
+            # Mostly static fleet: 2% of lamps see a new traffic count, time of day moves for 1%
+            readings = readings.copy()
+            traffic = rng.random(n_lamps) < 0.02
+            readings[traffic, 2] = rng.uniform(0, 900, traffic.sum())
+            clock = rng.random(n_lamps) < 0.01
+            readings[clock, 5] = np.minimum(readings[clock, 5] + 0.1, 24)
+
+            start = time.perf_counter()
+            expected = engine.compute(readings)
+            full_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = evaluator.tick(readings)
+            incremental_time += time.perf_counter() - start
+
+            for e, a in zip(expected, actual):
+                if not np.array_equal(e, a, equal_nan=True):
+                    raise AssertionError("incremental result differs from a full recompute")
+
+        print(f"{n_lamps} lamps, {ticks} ticks{' with a fallback' if fallback else ''}, "
+              f"outputs identical to a full recompute")
+        print(f"  full recompute: {full_time / ticks * 1000:.1f} ms/tick")
+        print(f"  incremental:    {incremental_time / ticks * 1000:.1f} ms/tick "
+              f"({full_time / incremental_time:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
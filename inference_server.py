@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import collections
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from batch_engine import OUTPUT_LABELS, BatchEngine
+from model_definition import load_model
+from stream_readings import OK, parse_chunk
+from telemetry import Telemetry
+
+# Protocol: one JSON object per line in each direction. A reading such as
+#   {"ambient light": 90, "distance": 15, "traffic activity": 200,
+#    "pedestrian activity": 150, "visibility": 750, "time of day": 21}
+# is answered with {"brightness": ..., "colour temperature": ...} (null when no rule
+# fired) or {"error": ...}. {"command": "stats"} returns latency and batch statistics;
+# {"command": "metrics"} returns per-stage timings and rule firing counts when the server
+# runs with --telemetry.
+
+DEFAULT_SOCKET = '/tmp/street_lighting.sock'
+
+
+class MicroBatcher:
+    # Collects readings that arrive within `window` seconds of each other and evaluates
+    # them as one batch. All evaluation happens on a single worker thread that owns the
+    # engine, so no simulation state is ever shared between requests.
+
+    def __init__(self, engine, window=0.002, max_batch=1024, history=10000):
+        self.engine = engine
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latencies = collections.deque(maxlen=history)
+        self.batch_sizes = collections.deque(maxlen=history)
+        self.requests = 0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown()
+
+    async def evaluate(self, values):
+        # Queue one reading (6 floats) and wait for its (brightness, colour temperature)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((time.perf_counter(), values, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            inputs = np.array([values for _, values, _ in batch])
+            try:
+                outputs = await loop.run_in_executor(self.executor, self.engine.compute, inputs)
+            except Exception as error:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            done = time.perf_counter()
+            self.batch_sizes.append(len(batch))
+            for i, (queued, _, future) in enumerate(batch):
+                self.latencies.append(done - queued)
+                self.requests += 1
+                if not future.done():
+                    future.set_result(tuple(float(output[i]) for output in outputs))
+
+    async def metrics(self):
+        # Read on the worker thread, so the counters are never caught mid-batch
+        telemetry = self.engine.telemetry
+        if telemetry is None:
+            return {'error': "telemetry is off; start the server with --telemetry"}
+        return await asyncio.get_running_loop().run_in_executor(self.executor, telemetry.snapshot)
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        sizes = np.array(self.batch_sizes)
+        return {
+            'requests': self.requests,
+            'batches': len(sizes),
+            'latency p50 ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'latency p99 ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            'batch size mean': float(sizes.mean()) if len(sizes) else None,
+            'batch size max': int(sizes.max()) if len(sizes) else None,
+        }
+
+
+async def handle_client(batcher, reader, writer):
+    try:
+        while line := await reader.readline():
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = None
+
+            if isinstance(request, dict) and request.get('command') == 'stats':
+                response = batcher.stats()
+            elif isinstance(request, dict) and request.get('command') == 'metrics':
+                response = await batcher.metrics()
+            elif not isinstance(request, dict):
+                response = {'error': "expected a JSON object per line"}
+            else:
+                values, status = parse_chunk([request])
+                if status[0] != OK:
+                    response = {'error': status[0]}
+                else:
+                    outputs = await batcher.evaluate(values[0])
+                    response = {label: None if math.isnan(value) else value
+                                for label, value in zip(OUTPUT_LABELS, outputs)}
+
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(socket_path=DEFAULT_SOCKET, port=None, window=0.002, max_batch=1024, telemetry=False, model=None):
+    engine = BatchEngine(load_model(model), centroid='breakpoints')
+    if telemetry:
+        engine.telemetry = Telemetry(len(engine.rules))
+    batcher = MicroBatcher(engine, window, max_batch)
+    batcher.start()
+
+    def handler(reader, writer):
+        return handle_client(batcher, reader, writer)
+
+    if port is not None:
+        server = await asyncio.start_server(handler, '127.0.0.1', port)
+        where = f"127.0.0.1:{port}"
+    else:
+        server = await asyncio.start_unix_server(handler, socket_path)
+        where = socket_path
+
+    print(f"Serving on {where} (batch window {window * 1000:.1f} ms, max batch {max_batch})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the street lighting controller with request micro-batching.")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f"Unix socket path (default: {DEFAULT_SOCKET})")
+    parser.add_argument('--port', type=int, help="listen on TCP 127.0.0.1:PORT instead of a Unix socket")
+    parser.add_argument('--window-ms', type=float, default=2.0, help="how long to gather requests into a batch")
+    parser.add_argument('--max-batch', type=int, default=1024, help="largest batch evaluated at once")
+    parser.add_argument('--telemetry', action='store_true', help="record stage timings and rule firing counts")
+    parser.add_argument('--model', help="model definition file (default: lighting_model.json)")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.socket, args.port, args.window_ms / 1000, args.max_batch, args.telemetry, args.model))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from batch_engine import INPUT_LABELS, random_inputs
+from inference_server import DEFAULT_SOCKET
+
+
+async def open_connection(socket_path, port):
+    if port is not None:
+        return await asyncio.open_connection('127.0.0.1', port)
+    return await asyncio.open_unix_connection(socket_path)
+
+
+async def client(socket_path, port, readings, latencies):
+    # One lamp controller: sends its readings one after another, waiting for each answer
+    reader, writer = await open_connection(socket_path, port)
+    for row in readings:
+        start = time.perf_counter()
+        writer.write(json.dumps(dict(zip(INPUT_LABELS, row.tolist()))).encode() + b'\n')
+        await writer.drain()
+        await reader.readline()
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def run(socket_path, port, clients, requests):
+    inputs = random_inputs(clients * requests, seed=6).reshape(clients, requests, len(INPUT_LABELS))
+    latencies = []
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(socket_path, port, inputs[i], latencies) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    print(f"{len(latencies)} requests from {clients} clients in {elapsed:.2f} s "
+          f"({len(latencies) / elapsed:.0f} requests/s)")
+    print(f"client latency: p50 {np.percentile(latencies, 50):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+
+    reader, writer = await open_connection(socket_path, port)
+    writer.write(b'{"command": "stats"}\n')
+    await writer.drain()
+    print("server stats:", json.loads(await reader.readline()))
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running inference_server.py.")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f"Unix socket path (default: {DEFAULT_SOCKET})")
+    parser.add_argument('--port', type=int, help="connect to TCP 127.0.0.1:PORT instead of a Unix socket")
+    parser.add_argument('--clients', type=int, default=200, help="concurrent connections (default: 200)")
+    parser.add_argument('--requests', type=int, default=50, help="requests per connection (default: 50)")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.socket, args.port, args.clients, args.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+import argparse
+import collections
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+# The model A1.py ships with
+DEFAULT_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lighting_model.json')
+
+# Bump when the layout of the compiled files changes, so old cache entries are ignored
+COMPILED_VERSION = 2
+
+# A model definition (JSON, or YAML if PyYAML is installed) looks like
+#   {"inputs": [{"label": "distance", "name": "distance", "universe": [0, 110, 0.1],
+#                "terms": {"close": {"trimf": [5, 13, 20]}, ...}}, ...],
+#    "outputs": [... same as inputs ...],
+#    "rules": [{"scenario": "...", "if": "distance[close] & (time of day[dusk] | time of day[night])",
+#               "then": {"brightness": "high", "colour temperature": "neutral white"}}, ...]}
+# "universe" is (start, stop, step) for np.arange, "name" is the attribute the variable gets
+# on A1.LightingSystem, and every term names a function from skfuzzy.membership with its
+# parameters (a list is passed as one argument, an object as keyword arguments).
+# Rule conditions use the same operators as skfuzzy rules: & (and), | (or), ~ (not).
+# Variables and terms may carry a "note" for whoever edits the file (units, where a value
+# comes from); it is left out of validation and compilation.
+# An optional "fallback": {"brightness": ..., "colour temperature": ...} is what BatchEngine
+# returns for readings where no rule fires (see rule_coverage.py for where that happens).
+
+# Parts of a rule condition: parentheses, operators, and variable[term]
+_TOKEN = re.compile(r'\s*(?:([()&|~])|([^\[\]()&|~]+?)\s*\[([^\]]+)\])')
+
+# What BatchEngine and SupportIndex read from a fuzzy variable
+Variable = collections.namedtuple('Variable', 'label universe terms')
+MembershipTerm = collections.namedtuple('MembershipTerm', 'label mf')
+
+
+class CompiledModel:
+    # A model definition evaluated into plain arrays: universes, sampled membership
+    # functions and rules as nested tuples. BatchEngine accepts it in place of a skfuzzy
+    # ControlSystem, and it loads from the disk cache without importing skfuzzy.
+
+    def __init__(self, digest, antecedents, consequents, rule_table, scenarios, fallback=None):
+        self.digest = digest
+        self.antecedents = antecedents
+        self.consequents = consequents
+        # [(antecedent expression, [(output label, term label, weight), ...]), ...]
+        self.rule_table = rule_table
+        self.scenarios = scenarios
+        # {output label: value} for readings where no rule fires, or None for NaN
+        self.fallback = fallback
+
+
+def load_definition(path=None):
+    path = path or DEFAULT_MODEL
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Reading YAML model definitions needs PyYAML (pip install pyyaml)") from None
+            definition = yaml.safe_load(f)
+        else:
+            definition = json.load(f)
+    validate(definition)
+    return definition
+
+
+def content_hash(definition, step_scale=1):
+    # Same hash for the same model however the file was formatted (or JSON vs YAML)
+    canonical = json.dumps([COMPILED_VERSION, step_scale, definition], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def parse_condition(text):
+    # "a[x] & (b[y] | ~c[z])" -> ('and', ('term', 'a', 'x'), ('or', ('term', 'b', 'y'), ('not', ...)))
+    # & binds tighter than | and both group from the left, as in Python
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise ValueError(f"Can't parse rule condition at {text[position:]!r}")
+        operator, variable, term = match.groups()
+        tokens.append(operator if operator else ('term', variable.strip(), term.strip()))
+        position = match.end()
+    tokens.append(None)
+
+    def peek():
+        return tokens[0]
+
+    def take(expected=None):
+        token = tokens.pop(0)
+        if expected is not None and token != expected:
+            raise ValueError(f"Expected {expected!r} in rule condition {text!r}")
+        return token
+
+    def parse_or():
+        expression = parse_and()
+        while peek() == '|':
+            take()
+            expression = ('or', expression, parse_and())
+        return expression
+
+    def parse_and():
+        expression = parse_not()
+        while peek() == '&':
+            take()
+            expression = ('and', expression, parse_not())
+        return expression
+
+    def parse_not():
+        token = take()
+        if token == '~':
+            return ('not', parse_not())
+        if token == '(':
+            expression = parse_or()
+            take(')')
+            return expression
+        if isinstance(token, tuple):
+            return token
+        raise ValueError(f"Unexpected {token!r} in rule condition {text!r}")
+
+    expression = parse_or()
+    take(None)
+    return expression
+
+
+def validate(definition):
+    # Catch typos in variable and term names before anything gets built
+    terms = {}
+    for kind in ('inputs', 'outputs'):
+        for var in definition.get(kind, []):
+            for key in ('label', 'name', 'universe', 'terms'):
+                if key not in var:
+                    raise ValueError(f"{kind[:-1].capitalize()} {var.get('label', '?')!r} has no {key!r}")
+            for term_label, term in var['terms'].items():
+                if not isinstance(term, dict) or len(set(term) - {'note'}) != 1:
+                    raise ValueError(f"Term {var['label']}[{term_label}] needs exactly one membership function")
+            terms[kind, var['label']] = set(var['terms'])
+    if not definition.get('rules'):
+        raise ValueError("Model definition has no rules")
+    for label, value in (definition.get('fallback') or {}).items():
+        if ('outputs', label) not in terms:
+            raise ValueError(f"Fallback for unknown output {label!r}")
+        if not isinstance(value, (int, float)):
+            raise ValueError(f"Fallback for {label!r} must be a number, got {value!r}")
+
+    for number, rule in enumerate(definition['rules'], 1):
+        for _, label, term in _term_references(parse_condition(rule['if'])):
+            if ('inputs', label) not in terms:
+                raise ValueError(f"Rule {number}: unknown input {label!r}")
+            if term not in terms['inputs', label]:
+                raise ValueError(f"Rule {number}: {label!r} has no term {term!r}")
+        for label, term in rule['then'].items():
+            if ('outputs', label) not in terms:
+                raise ValueError(f"Rule {number}: unknown output {label!r}")
+            if term not in terms['outputs', label]:
+                raise ValueError(f"Rule {number}: {label!r} has no term {term!r}")
+
+
+def _term_references(expression):
+    if expression[0] == 'term':
+        return [expression]
+    return [term for part in expression[1:] for term in _term_references(part)]
+
+
+def universe(var, step_scale=1):
+    start, stop, step = var['universe']
+    return np.arange(start, stop, step * step_scale)
+
+
+def term_function(term):
+    # (skfuzzy.membership function name, parameters) of a term, past its optional note
+    (function, parameters), = ((key, value) for key, value in term.items() if key != 'note')
+    return function, parameters
+
+
+def membership(x, term):
+    from skfuzzy import membership as mf
+
+    function, parameters = term_function(term)
+    if isinstance(parameters, dict):
+        return getattr(mf, function)(x, **parameters)
+    return getattr(mf, function)(x, parameters)
+
+
+def build_variables(definition, step_scale=1):
+    # skfuzzy Antecedents and Consequents, keyed by their "name"
+    from skfuzzy import control as ctrl
+
+    variables = {}
+    for kind, cls in (('inputs', ctrl.Antecedent), ('outputs', ctrl.Consequent)):
+        for var in definition[kind]:
+            variable = cls(universe(var, step_scale), var['label'])
+            for term_label, term in var['terms'].items():
+                variable[term_label] = membership(variable.universe, term)
+            variables[var['name']] = variable
+    return variables
+
+
+def build_rules(definition, variables):
+    # skfuzzy Rules over variables from build_variables
+    from skfuzzy import control as ctrl
+
+    by_label = {variable.label: variable for variable in variables.values()}
+
+    def build(expression):
+        kind = expression[0]
+        if kind == 'term':
+            return by_label[expression[1]][expression[2]]
+        if kind == 'not':
+            return ~build(expression[1])
+        left, right = build(expression[1]), build(expression[2])
+        return left & right if kind == 'and' else left | right
+
+    return [ctrl.Rule(build(parse_condition(rule['if'])),
+                      tuple(by_label[label][term] for label, term in rule['then'].items()))
+            for rule in definition['rules']]
+
+
+def compile_definition(definition, step_scale=1):
+    # Evaluate the membership functions and parse the rules; no skfuzzy graph is built
+    def variables(kind):
+        compiled = []
+        for var in definition[kind]:
+            x = universe(var, step_scale)
+            terms = {term_label: MembershipTerm(term_label, membership(x, term))
+                     for term_label, term in var['terms'].items()}
+            compiled.append(Variable(var['label'], x, terms))
+        return compiled
+
+    rule_table = [(parse_condition(rule['if']), [(label, term, 1.0) for label, term in rule['then'].items()])
+                  for rule in definition['rules']]
+    scenarios = [rule.get('scenario', '') for rule in definition['rules']]
+    return CompiledModel(content_hash(definition, step_scale), variables('inputs'), variables('outputs'),
+                         rule_table, scenarios, definition.get('fallback'))
+
+
+def cache_directory():
+    if 'STREET_LIGHTING_CACHE' in os.environ:
+        return os.environ['STREET_LIGHTING_CACHE']
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'street_lighting')
+
+
+def save_compiled(model, path):
+    # Arrays go in as numbered .npy entries, everything else as one JSON string, so the
+    # file loads with allow_pickle=False. Written to a temporary file and renamed, so a
+    # worker never reads a half-written file.
+    arrays = {}
+    variables = []
+    for kind, group in (('input', model.antecedents), ('output', model.consequents)):
+        for var in group:
+            i = len(variables)
+            arrays[f'universe_{i}'] = var.universe
+            for j, term in enumerate(var.terms.values()):
+                arrays[f'mf_{i}_{j}'] = term.mf
+            variables.append({'kind': kind, 'label': var.label, 'terms': list(var.terms)})
+    meta = {'digest': model.digest, 'variables': variables, 'rules': model.rule_table, 'scenarios': model.scenarios,
+            'fallback': model.fallback}
+    arrays['meta'] = np.array(json.dumps(meta))
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+        np.savez(f, **arrays)
+    os.replace(f.name, path)
+
+
+def load_compiled(path):
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['meta']))
+        groups = {'input': [], 'output': []}
+        for i, var in enumerate(meta['variables']):
+            terms = {label: MembershipTerm(label, data[f'mf_{i}_{j}']) for j, label in enumerate(var['terms'])}
+            groups[var['kind']].append(Variable(var['label'], data[f'universe_{i}'], terms))
+    rule_table = [(_as_tuples(expression), [tuple(c) for c in consequent]) for expression, consequent in meta['rules']]
+    return CompiledModel(meta['digest'], groups['input'], groups['output'], rule_table, meta['scenarios'],
+                         meta.get('fallback'))
+
+
+def _as_tuples(expression):
+    # JSON turns the nested tuples into lists; BatchEngine expects tuples
+    if expression[0] == 'term':
+        return tuple(expression)
+    return (expression[0], *(_as_tuples(part) for part in expression[1:]))
+
+
+def load_model(path=None, step_scale=1, cache_dir=None):
+    # Compiled model for a definition file, from the cache when this exact definition
+    # (by content hash) has been compiled before
+    definition = load_definition(path)
+    digest = content_hash(definition, step_scale)
+    cached = os.path.join(cache_dir or cache_directory(), f'{digest}.npz')
+
+    if os.path.exists(cached):
+        try:
+            return load_compiled(cached)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            pass  # unreadable or from an older layout: compile it again
+
+    model = compile_definition(definition, step_scale)
+    try:
+        save_compiled(model, cached)
+    except OSError:
+        pass  # read-only cache: still usable, just compiled every time
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a lighting model definition and cache it on disk.")
+    parser.add_argument('definition', nargs='?', default=DEFAULT_MODEL, help="JSON or YAML model file")
+    parser.add_argument('--cache-dir', help=f"where compiled models are kept (default: {cache_directory()})")
+    parser.add_argument('--check', action='store_true',
+                        help="compare the compiled model with the skfuzzy control system built from the same file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    definition = load_definition(args.definition)
+    model = compile_definition(definition)
+    compile_time = time.perf_counter() - start
+    save_compiled(model, os.path.join(args.cache_dir or cache_directory(), f'{model.digest}.npz'))
+
+    start = time.perf_counter()
+    model = load_model(args.definition, cache_dir=args.cache_dir)
+    load_time = time.perf_counter() - start
+
+    print(f"{args.definition}: {len(model.rule_table)} rules, hash {model.digest[:16]}")
+    print(f"compile: {compile_time * 1000:.1f} ms, load from cache: {load_time * 1000:.1f} ms")
+
+    if args.check:
+        from skfuzzy import control as ctrl
+
+        from batch_engine import BatchEngine, max_difference, random_inputs
+
+        start = time.perf_counter()
+        variables = build_variables(definition)
+        control_system = ctrl.ControlSystem(build_rules(definition, variables))
+        build_time = time.perf_counter() - start
+
+        inputs = random_inputs(5000, seed=14)
+        expected = BatchEngine(control_system, centroid='breakpoints').compute(inputs)
+        actual = BatchEngine(model, centroid='breakpoints').compute(inputs)
+        print(f"skfuzzy control system build: {build_time * 1000:.1f} ms")
+        print(f"largest difference over {len(inputs)} readings: {max_difference(expected, actual)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from batch_engine import INPUT_LABELS, OUTPUT_LABELS, BatchEngine, random_inputs
+from model_definition import load_model
+
+# Engine owned by each worker process, built once by _init_worker
+_worker_engine = None
+
+
+def _init_worker(centroid, model):
+    global _worker_engine
+
+    # The parent compiled the model into the cache, so this is a file load, not a rebuild
+    _worker_engine = BatchEngine(load_model(model), centroid=centroid)
+
+
+def _run_shard(inputs_name, outputs_name, n, start, stop):
+    # Read rows start:stop from the shared input block and write their results in place,
+    # so only the block names and row range cross the process boundary
+    inputs_block = shared_memory.SharedMemory(name=inputs_name)
+    outputs_block = shared_memory.SharedMemory(name=outputs_name)
+    try:
+        inputs = np.ndarray((n, len(INPUT_LABELS)), dtype=np.float64, buffer=inputs_block.buf)
+        outputs = np.ndarray((n, len(OUTPUT_LABELS) + 1), dtype=np.float64, buffer=outputs_block.buf)
+        outputs[start:stop] = np.column_stack(_worker_engine.compute(inputs[start:stop], with_fired=True))
+        del inputs, outputs
+    finally:
+        inputs_block.close()
+        outputs_block.close()
+    return stop - start
+
+
+def _init_worker_ready(_):
+    # Trivial task: returning proves the worker's initializer has finished
+    return _worker_engine is not None
+
+
+class ShardedEngine:
+    # Splits large batches across a pool of worker processes. Each worker loads its own
+    # copy of the compiled model (a definition file, see model_definition.py) when it
+    # starts; readings and results are exchanged through shared memory instead of being
+    # pickled row by row.
+
+    def __init__(self, workers=None, centroid='breakpoints', shards_per_worker=4, model=None):
+        self.workers = workers or os.cpu_count()
+        self.shards_per_worker = shards_per_worker
+        self.model = load_model(model)
+        # Workers attaching to a block register it with the resource tracker; start the
+        # tracker first so they share the parent's instead of each starting their own
+        # (which would report the blocks as leaked and unlink them at exit)
+        resource_tracker.ensure_running()
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(centroid, model))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown()
+
+    def warm_up(self):
+        # Start the workers (and build their engines) before timing anything
+        list(self.pool.map(_init_worker_ready, range(self.workers)))
+
+    def compute(self, inputs, with_fired=False):
+        # Same results as BatchEngine.compute; each shard also reports which readings fired
+        # a rule, as a third column of the shared output block
+        inputs = np.asarray(inputs, dtype=np.float64).reshape(-1, len(INPUT_LABELS))
+        n = len(inputs)
+        if n == 0:
+            return (np.empty(0), np.empty(0)) + ((np.empty(0, dtype=bool),) if with_fired else ())
+
+        inputs_block = shared_memory.SharedMemory(create=True, size=inputs.nbytes)
+        outputs_block = shared_memory.SharedMemory(create=True, size=n * (len(OUTPUT_LABELS) + 1) * 8)
+        try:
+            np.ndarray(inputs.shape, dtype=np.float64, buffer=inputs_block.buf)[:] = inputs
+
+            bounds = np.linspace(0, n, min(n, self.workers * self.shards_per_worker) + 1).astype(int)
+            futures = [self.pool.submit(_run_shard, inputs_block.name, outputs_block.name, n, start, stop)
+                       for start, stop in zip(bounds[:-1], bounds[1:])]
+            for future in futures:
+                future.result()
+
+            outputs = np.ndarray((n, len(OUTPUT_LABELS) + 1), dtype=np.float64, buffer=outputs_block.buf).copy()
+        finally:
+            inputs_block.close()
+            inputs_block.unlink()
+            outputs_block.close()
+            outputs_block.unlink()
+
+        if with_fired:
+            return outputs[:, 0], outputs[:, 1], outputs[:, 2] > 0
+        return outputs[:, 0], outputs[:, 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sharded evaluation from 1 to N worker processes.")
+    parser.add_argument('--readings', type=int, default=500000, help="batch size (default: 500000)")
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help="largest pool to try")
+    args = parser.parse_args()
+
+    inputs = random_inputs(args.readings, seed=5)
+    baseline = None
+    print(f"{args.readings} readings on {os.cpu_count()} CPUs")
+    for workers in range(1, args.max_workers + 1):
+        with ShardedEngine(workers) as engine:
+            engine.warm_up()
+            start = time.perf_counter()
+            engine.compute(inputs)
+            elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:3d} workers: {elapsed:6.2f} s  {args.readings / elapsed:10.0f} readings/s  "
+              f"speedup {baseline / elapsed:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import sys
+import time
+
+import numpy as np
+
+from batch_engine import INPUT_LABELS, BatchEngine, random_inputs
+
+
+def universe_steps(engine):
+    # Sampling step of every input's universe in the engine's model. The engine interpolates
+    # memberships between those samples, so snapping readings to them does change answers:
+    # see snapping_error() for by how much before using them as cache steps.
+    # Works for a BatchEngine, or anything carrying the CompiledModel it runs (ShardedEngine).
+    antecedents = getattr(engine, 'antecedents', None)
+    if antecedents is None:
+        antecedents = {var.label: var for var in engine.model.antecedents}
+    return {label: float(var.universe[1] - var.universe[0]) for label, var in antecedents.items()}
+
+
+class CachedController:
+    # LRU cache in front of anything with compute(inputs, with_fired) like BatchEngine's,
+    # e.g. a BatchEngine or ShardedEngine. By default only readings that are exactly equal
+    # share a cached result, so the answers are the engine's own. steps='universe' (the
+    # universe_steps of the engine's model) or {input label: step} (the rest at their
+    # universe step) snaps readings to a per-input grid instead and answers every reading
+    # on a grid point with the engine's answer for that point; that is an approximation,
+    # measure it with snapping_error(). Memory is capped by evicting the least recently
+    # used entries.
+    #
+    # A batch is looked up in bulk: readings are deduplicated to their distinct keys
+    # with numpy, each distinct point costs one dict lookup, and results and recency live in
+    # arrays indexed by the slot the dict points to. Recency is kept per compute() call, so
+    # entries used in the same batch are equally recent.
+
+    def __init__(self, engine, steps=None, max_bytes=64 * 1024 * 1024):
+        self.engine = engine
+        if steps is None:
+            self.steps = None
+        else:
+            steps = dict(universe_steps(engine), **({} if steps == 'universe' else steps))
+            self.steps = np.array([steps[label] for label in INPUT_LABELS], dtype=float)
+        self.max_entries = max(1, max_bytes // self._entry_bytes())
+        self.slots = {}
+        self.keys = [None] * self.max_entries
+        self.values = np.empty((self.max_entries, 3))
+        self.last_used = np.full(self.max_entries, -1, dtype=np.int64)
+        self.batches = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry_bytes(self):
+        # Approximate size of one entry: its key, its dict slot, its row of results (both
+        # outputs and whether a rule fired) and recency
+        key = np.zeros(len(INPUT_LABELS), dtype=np.int64).tobytes()
+        return sys.getsizeof(key) + 100 + 4 * 8
+
+    def quantize(self, inputs):
+        # Integer key of every reading, one row per reading: the index of the grid point it
+        # snaps to, or without steps the bits of the reading itself (+ 0.0 turns -0.0 into
+        # 0.0, so the two share a key)
+        if self.steps is None:
+            return (inputs + 0.0).view(np.int64)
+        return np.round(inputs / self.steps).astype(np.int64)
+
+    def points(self, grid):
+        # The readings the keys in grid stand for, which is what the engine evaluates
+        if self.steps is None:
+            return grid.view(float)
+        return grid * self.steps
+
+    def compute(self, inputs, with_fired=False):
+        inputs = np.asarray(inputs, dtype=float).reshape(-1, len(INPUT_LABELS))
+        self.batches += 1
+        if len(inputs) == 0:
+            return (np.empty(0), np.empty(0)) + ((np.empty(0, dtype=bool),) if with_fired else ())
+
+        grid, inverse = _distinct_rows(self.quantize(inputs))
+        # One bytes key per distinct row, from a structured view of it
+        keys = np.ascontiguousarray(grid).view(np.dtype((np.void, grid.shape[1] * 8))).ravel().tolist()
+        slots = np.array([self.slots.get(key, -1) for key in keys], dtype=np.int64)
+
+        found = slots >= 0
+        hits = int(np.count_nonzero(found[inverse]))
+        self.hits += hits
+        self.misses += len(inputs) - hits
+        results = np.empty((len(grid), 3))
+        results[found] = self.values[slots[found]]
+        self.last_used[slots[found]] = self.batches
+
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            # Evaluate the points the keys stand for, so every reading that maps to a key
+            # gets the same answer no matter which one filled the cache
+            results[missing] = np.column_stack(self.engine.compute(self.points(grid[missing]), with_fired=True))
+            self._store([keys[i] for i in missing], results[missing])
+
+        results = results[inverse]
+        if with_fired:
+            return results[:, 0], results[:, 1], results[:, 2] > 0
+        return results[:, 0], results[:, 1]
+
+    def _store(self, keys, values):
+        # Put new entries in free slots, evicting the least recently used ones if needed;
+        # a batch with more new points than fit keeps only the first max_entries
+        keys, values = keys[:self.max_entries], values[:self.max_entries]
+        free = np.flatnonzero(self.last_used < 0)
+        if len(free) < len(keys):
+            used = np.flatnonzero(self.last_used >= 0)
+            evicted = used[np.argsort(self.last_used[used], kind='stable')[:len(keys) - len(free)]]
+            for slot in evicted:
+                del self.slots[self.keys[slot]]
+            self.evictions += len(evicted)
+            free = np.concatenate([free, evicted])
+        slots = free[:len(keys)]
+        for key, slot in zip(keys, slots.tolist()):
+            self.slots[key] = slot
+            self.keys[slot] = key
+        self.values[slots] = values
+        self.last_used[slots] = self.batches
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.slots),
+            'max entries': self.max_entries,
+        }
+
+
+def snapping_error(engine, steps, inputs):
+    # What snapping to the given steps (as CachedController takes them) costs over some
+    # readings: how many of them flip between fired and not, and the largest and 99th
+    # percentile output differences where both fired
+    exact = engine.compute(inputs, with_fired=True)
+    snapped = CachedController(engine, steps=steps).compute(inputs, with_fired=True)
+    both = exact[2] & snapped[2]
+    report = {'fired flips': int(np.count_nonzero(exact[2] != snapped[2]))}
+    for label, e, a in zip(('brightness', 'colour temperature'), exact, snapped):
+        difference = np.abs(e[both] - a[both])
+        report[label] = (float(difference.max(initial=0.0)),
+                         float(np.percentile(difference, 99)) if len(difference) else 0.0)
+    return report
+
+
+def _distinct_rows(grid):
+    # Distinct rows of an integer array, and which of them each row is. Rows are packed into
+    # one int64 each when the batch's ranges allow, which sorts far faster than whole rows.
+    # The ranges are checked in floats: the raw bits of exact keys can span all of int64.
+    lo = grid.min(axis=0)
+    if np.prod(grid.max(axis=0).astype(float) - lo + 1) < 2 ** 62:
+        span = grid.max(axis=0) - lo + 1
+        packed = (grid - lo) @ np.cumprod(np.r_[1, span[:-1]])
+        _, first, inverse = np.unique(packed, return_index=True, return_inverse=True)
+        return grid[first], inverse.reshape(-1)
+    # Otherwise sort the rows as opaque bytes, still faster than np.unique(axis=0)
+    rows = np.ascontiguousarray(grid).view(np.dtype((np.void, grid.shape[1] * grid.itemsize))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return grid[first], inverse.reshape(-1)
+
+
+def main():
+    import A1
+
+    engine = BatchEngine(A1.train_ctrl, centroid='breakpoints')
+    caches = {'exact': CachedController(engine, max_bytes=8 * 1024 * 1024),
+              'universe steps': CachedController(engine, steps='universe', max_bytes=8 * 1024 * 1024)}
+
+    # A fleet of lamps at fixed distances whose readings repeat from tick to tick
+    rng = np.random.default_rng(7)
+    lamps = random_inputs(5000, seed=8)
+    lamps[:, 2:4] = np.round(lamps[:, 2:4])
+    ticks = 20
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        engine.compute(lamps)
+    uncached = time.perf_counter() - start
+
+    print(f"uncached: {uncached / ticks * 1000:.1f} ms/tick")
+    for name, cache in caches.items():
+        # Every cache sees the same ticks
+        tick_rng = np.random.default_rng(rng.integers(2 ** 32))
+        readings = lamps.copy()
+        start = time.perf_counter()
+        for _ in range(ticks):
+            jitter = tick_rng.random(len(readings)) < 0.05
+            readings[jitter, 2] = np.clip(readings[jitter, 2] + tick_rng.integers(-5, 6, jitter.sum()), 0, 900)
+            cache.compute(readings)
+        cached = time.perf_counter() - start
+        print(f"cached ({name}): {cached / ticks * 1000:.1f} ms/tick, {cache.stats()}")
+
+    # What the snapping costs, over readings of the whole input space
+    report = snapping_error(engine, 'universe', random_inputs(50000, seed=9))
+    print(f"universe steps on 50000 readings: {report['fired flips']} flip between fired and not")
+    for label in ('brightness', 'colour temperature'):
+        print(f"  {label}: max difference {report[label][0]:.1f}, 99th percentile {report[label][1]:.1f}")
+
+
+if __name__ == '__main__':
+    main()
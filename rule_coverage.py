@@ -0,0 +1,198 @@
+import argparse
+import json
+
+import numpy as np
+
+from batch_engine import INPUT_LABELS, BatchEngine
+from support_index import _conjuncts, _support
+
+
+class Interval:
+    # Range of one input; a single value when lo == hi
+
+    def __init__(self, lo, hi, lo_closed=False, hi_closed=False):
+        self.lo, self.hi = float(lo), float(hi)
+        self.lo_closed, self.hi_closed = lo_closed, hi_closed
+
+    def join(self, other):
+        # Union with the interval right after this one
+        return Interval(self.lo, other.hi, self.lo_closed, other.hi_closed)
+
+    def width(self):
+        return self.hi - self.lo
+
+    def contains(self, values):
+        above = values >= self.lo if self.lo_closed else values > self.lo
+        below = values <= self.hi if self.hi_closed else values < self.hi
+        return above & below
+
+    def __eq__(self, other):
+        return (self.lo, self.hi, self.lo_closed, self.hi_closed) == (other.lo, other.hi, other.lo_closed, other.hi_closed)
+
+    def __str__(self):
+        if self.lo == self.hi:
+            return f"= {self.lo:g}"
+        return f"in {'[' if self.lo_closed else '('}{self.lo:g}, {self.hi:g}{']' if self.hi_closed else ')'}"
+
+
+def input_pieces(var):
+    # Split an input's universe at every support end: single boundary values and the open
+    # intervals between them. On each piece every term is either zero everywhere or
+    # non-zero everywhere, so a rule's truth on a piece is exact, not sampled.
+    x = var.universe.astype(float)
+    supports = {term_label: _support(x, term.mf) for term_label, term in var.terms.items()}
+    ends = [end for support in supports.values() for end in support if x[0] <= end <= x[-1]]
+    bounds = np.unique(ends + [x[0], x[-1]])
+
+    pieces = []
+    for k, bound in enumerate(bounds):
+        pieces.append(Interval(bound, bound, True, True))
+        if k + 1 < len(bounds):
+            pieces.append(Interval(bound, bounds[k + 1]))
+    middles = np.array([(piece.lo + piece.hi) / 2 for piece in pieces])
+    nonzero = {term_label: (middles > lo) & (middles < hi) for term_label, (lo, hi) in supports.items()}
+    return pieces, nonzero
+
+
+def _truth(expression, nonzero, assigned):
+    # Can the expression be non-zero on the assigned pieces? True, False, or None when
+    # it depends on inputs not assigned yet
+    kind = expression[0]
+    if kind == 'term':
+        piece = assigned.get(expression[1])
+        return None if piece is None else bool(nonzero[expression[1]][expression[2]][piece])
+    if kind == 'not':
+        # 1 - mu is non-zero unless mu is exactly 1, which supports don't tell us
+        return None if _truth(expression[1], nonzero, assigned) is None else True
+    left = _truth(expression[1], nonzero, assigned)
+    right = _truth(expression[2], nonzero, assigned)
+    if kind == 'and':
+        if left is False or right is False:
+            return False
+        return True if left and right else None
+    if left or right:
+        return True
+    return False if left is False and right is False else None
+
+
+def uncovered_regions(engine):
+    # Input regions where no rule can fire, as a list of {input label: Interval} (inputs
+    # left out can take any value). Inputs are fixed one at a time; a branch stops as soon
+    # as every rule is ruled out (uncovered) or one is sure to fire (covered). Consecutive
+    # pieces with the same outcome are merged. A NOT is treated as possibly firing, so
+    # everything listed is certain to fire no rule.
+    pieces, nonzero = {}, {}
+    for label in INPUT_LABELS:
+        pieces[label], nonzero[label] = input_pieces(engine.antecedents[label])
+    rules = [[(clause, sorted(engine.terms_used(clause))) for clause in _conjuncts(expression)]
+             for expression, _ in engine.rules]
+
+    def state(assigned):
+        # What is left to decide: for every rule still alive, which of its terms are
+        # non-zero on the assigned pieces, clause by clause. Branches in the same state
+        # have the same uncovered regions below them.
+        key = []
+        for clauses in rules:
+            truths = [_truth(clause, nonzero, assigned) for clause, _ in clauses]
+            if False in truths:
+                key.append(False)
+            elif all(truths):
+                return True
+            else:
+                key.append(tuple(tuple(bool(nonzero[label][term][assigned[label]])
+                                       for label, term in terms if label in assigned)
+                                 for (clause, terms), truth in zip(clauses, truths) if truth is None))
+        return tuple(key)
+
+    memo = {}
+
+    def search(depth, assigned, key):
+        if key is True:
+            return []
+        if all(rule is False for rule in key):
+            return [{}]
+        if (depth, key) in memo:
+            return memo[depth, key]
+
+        label = INPUT_LABELS[depth]
+        merged = []  # (interval, state below it, regions below it)
+        for index, piece in enumerate(pieces[label]):
+            below = dict(assigned, **{label: index})
+            child = state(below)
+            if merged and child == merged[-1][1]:
+                merged[-1] = (merged[-1][0].join(piece), child, merged[-1][2])
+            else:
+                merged.append((piece, child, search(depth + 1, below, child)))
+        regions = [dict(region, **{label: interval}) for interval, _, regions in merged for region in regions]
+        memo[depth, key] = regions
+        return regions
+
+    return search(0, {}, state({}))
+
+
+def region_volume(region, engine):
+    # Share of the whole input space a region takes up
+    volume = 1.0
+    for label, interval in region.items():
+        universe = engine.antecedents[label].universe
+        volume *= interval.width() / (universe.max() - universe.min())
+    return volume
+
+
+def in_region(region, inputs):
+    # Readings (N x 6) inside a region, after clipping to the universes like skfuzzy does
+    inside = np.ones(len(inputs), dtype=bool)
+    for label, interval in region.items():
+        inside &= interval.contains(inputs[:, INPUT_LABELS.index(label)])
+    return inside
+
+
+def describe(region):
+    return ", ".join(f"{label} {region[label]}" for label in INPUT_LABELS if label in region) or "everywhere"
+
+
+def main():
+    from batch_engine import random_inputs
+    from model_definition import load_model
+
+    parser = argparse.ArgumentParser(description="List the input regions where no rule of the model can fire.")
+    parser.add_argument('--model', help="model definition file (default: lighting_model.json)")
+    parser.add_argument('--top', type=int, default=20, help="how many of the largest regions to print (default: 20)")
+    parser.add_argument('--json', metavar='FILE', help="write every region to this JSON file")
+    parser.add_argument('--check', type=int, default=0, metavar='N',
+                        help="cross-check against the engine on N random readings")
+    args = parser.parse_args()
+
+    engine = BatchEngine(load_model(args.model), centroid='breakpoints')
+    regions = uncovered_regions(engine)
+    volumes = [region_volume(region, engine) for region in regions]
+    order = np.argsort(volumes)[::-1]
+
+    print(f"{len(regions)} uncovered regions, {sum(volumes):.1%} of the input space "
+          f"(plus boundary values, which take up no volume)")
+    for i in order[:args.top]:
+        print(f"  {volumes[i]:7.2%}  {describe(regions[i])}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([{label: [interval.lo, interval.hi, interval.lo_closed, interval.hi_closed]
+                        for label, interval in region.items()} for region in regions], f, indent=1)
+
+    if args.check:
+        inputs = random_inputs(args.check, seed=16)
+        # Exact boundary values too, where sensors often sit (e.g. no traffic at all)
+        inputs[: args.check // 10, 2] = 0
+        brightness, _ = engine.compute(inputs)
+        clipped = np.clip(inputs, [var.universe.min() for var in map(engine.antecedents.get, INPUT_LABELS)],
+                          [var.universe.max() for var in map(engine.antecedents.get, INPUT_LABELS)])
+        predicted = np.zeros(len(inputs), dtype=bool)
+        for region in regions:
+            predicted |= in_region(region, clipped)
+        unfired = np.isnan(brightness)
+        print(f"check on {len(inputs)} readings: {unfired.sum()} fired no rule, {predicted.sum()} predicted; "
+              f"{np.count_nonzero(predicted & ~unfired)} predicted but fired, "
+              f"{np.count_nonzero(unfired & ~predicted)} missed")
+
+
+if __name__ == '__main__':
+    main()
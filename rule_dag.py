@@ -0,0 +1,204 @@
+import numpy as np
+
+
+class RuleDAG:
+    # The antecedents of a whole rule base as one expression graph in which every distinct
+    # subexpression is a single node, so it is evaluated once per batch and shared by every
+    # rule that reads it (e.g. "visibility[moderate] | visibility[clear]" appears in most
+    # of A1's rules).
+    #
+    # AND and OR are associative, commutative and idempotent on fmin/fmax, so chains of them
+    # are flattened, their operands deduplicated and rebuilt as a left-deep chain with the
+    # operands most rules use first: "a | b | c" and "c | (a | b)" become the same node, and
+    # rules that share clauses share the start of their chains too. Reordering fmin/fmax
+    # operands doesn't change a single bit of the result.
+
+    def __init__(self, expressions):
+        # Each expression in a canonical form first: chains become (kind, operands)
+        canonical = [_canonical(expression) for expression in expressions]
+        self.uses = {}
+        for expression in canonical:
+            self._count(expression)
+        self.rank = {operand: rank for rank, operand in enumerate(self.uses)}
+
+        # nodes[i] is ('term', variable, term) or (kind, operand node, ...); a node only
+        # refers to earlier ones, so list order is an evaluation order
+        self.nodes = []
+        self.ids = {}
+        self.built = {}
+        self.roots = [self._add(expression) for expression in canonical]
+
+        # The evaluation as a flat list of steps (node, ufunc, first, second, recycled, rules):
+        # NOT is 1 - x, with the constant 1 kept in an extra slot past the last node;
+        # recycled lists the operands (and the node itself) whose arrays nothing reads
+        # after this step, and rules the rules whose strength this node is
+        last_use = list(range(len(self.nodes)))
+        for node, (kind, *operands) in enumerate(self.nodes):
+            if kind != 'term':
+                for operand in operands:
+                    last_use[operand] = node
+        rules_at = {}
+        for rule, root in enumerate(self.roots):
+            rules_at.setdefault(root, []).append(rule)
+
+        one = len(self.nodes)
+        self.steps = []
+        for node, (kind, *operands) in enumerate(self.nodes):
+            if kind == 'term':
+                continue
+            function = {'and': np.fmin, 'or': np.fmax, 'not': np.subtract}[kind]
+            first, second = (one, operands[0]) if kind == 'not' else operands
+            recycled = [o for o in {first, second, node}
+                        if o != one and self.nodes[o][0] != 'term' and last_use[o] == node]
+            self.steps.append((node, function, first, second, recycled, rules_at.get(node)))
+        self.terms = [node[1:] for node in self.nodes if node[0] == 'term']
+        # Rules that are a single term never show up as a step
+        self.term_rules = [(rules, self.nodes[root][1:]) for root, rules in rules_at.items()
+                           if self.nodes[root][0] == 'term']
+
+    def _count(self, expression):
+        # How many chains each operand appears in, in first-seen order for ties
+        if expression[0] in ('and', 'or'):
+            for operand in expression[1]:
+                self.uses[operand] = self.uses.get(operand, 0) + 1
+                self._count(operand)
+        elif expression[0] == 'not':
+            self._count(expression[1])
+
+    def _node(self, key):
+        if key not in self.ids:
+            self.ids[key] = len(self.nodes)
+            self.nodes.append(key)
+        return self.ids[key]
+
+    def _add(self, expression):
+        if expression in self.built:
+            return self.built[expression]
+        kind = expression[0]
+        if kind == 'term':
+            node = self._node(expression)
+        elif kind == 'not':
+            node = self._node(('not', self._add(expression[1])))
+        else:
+            operands = sorted(expression[1], key=lambda operand: (-self.uses[operand], self.rank[operand]))
+            node = self._add(operands[0])
+            for operand in operands[1:]:
+                node = self._node((kind, node, self._add(operand)))
+        self.built[expression] = node
+        return node
+
+    def operations(self):
+        # Number of AND/OR/NOT operations one evaluation of the whole graph costs
+        return len(self.steps)
+
+    def evaluate(self, memberships):
+        # Firing strength of every rule, shape (number of rules, N). Intermediate arrays
+        # are recycled as soon as nothing else reads them, so the working set stays at a
+        # few arrays however many rules there are.
+        n = len(next(iter(memberships.values())))
+        strengths = np.empty((len(self.roots), n))
+        values = [memberships[node[1:]] if node[0] == 'term' else None for node in self.nodes] + [1.0]
+        spare = []
+        for node, function, first, second, recycled, rules in self.steps:
+            values[node] = function(values[first], values[second], spare.pop() if spare else np.empty(n))
+            if rules:
+                strengths[rules] = values[node]
+            for operand in recycled:
+                spare.append(values[operand])
+        for rules, key in self.term_rules:
+            strengths[rules] = memberships[key]
+        return strengths
+
+
+def _canonical(expression):
+    kind = expression[0]
+    if kind == 'term':
+        return expression
+    if kind == 'not':
+        return ('not', _canonical(expression[1]))
+    # Deduplicated and sorted by their text, so the graph is the same from run to run
+    operands = tuple(sorted({_canonical(part) for part in _chain(expression, kind)}, key=repr))
+    return operands[0] if len(operands) == 1 else (kind, operands)
+
+
+def _chain(expression, kind):
+    # Operands of a run of the same associative operator, e.g. a | (b | c) -> [a, b, c]
+    if expression[0] != kind:
+        return [expression]
+    return _chain(expression[1], kind) + _chain(expression[2], kind)
+
+
+def tree_operations(expression):
+    # Number of AND/OR/NOT operations evaluating one expression tree on its own costs
+    if expression[0] == 'term':
+        return 0
+    return 1 + sum(tree_operations(part) for part in expression[1:])
+
+
+def main():
+    import time
+    from types import SimpleNamespace
+
+    import A1
+    from batch_engine import BatchEngine, random_inputs
+    from support_index import synthetic_rules
+
+    system = A1.lighting_system()
+    batch = random_inputs(5000, seed=18)
+    singles = random_inputs(200, seed=19)
+
+    # Rule firing is timed on its own, with the candidates looked up beforehand; the
+    # batch compute columns are the whole engine, lookup included, without the index and
+    # with the default rule_index=True (which skips the lookup when it doesn't pay)
+    print(f"{'rules':>6} | {'AND/OR/NOT per reading':^22} | {'rule firing, batch of 5000 (us/reading)':^39} | "
+          f"{'batch compute (us/reading)':^26} | {'single reading, compute':^23}")
+    print(f"{'':>6} | {'per rule':>9} {'shared':>12} | {'all rules':>9} {'shared':>8} | {'indexed':>9} {'shared':>8} | "
+          f"{'no index':>8} {'default':>17} | {'per rule':>11} {'shared':>11}")
+    for extra in (0, 45, 225, 945, 3825):
+        rules = system.rules + synthetic_rules(system, extra)
+        # Only what BatchEngine reads, as in support_index.main
+        rule_base = SimpleNamespace(antecedents=list(system.train_ctrl.antecedents),
+                                    consequents=list(system.train_ctrl.consequents), rules=rules)
+        firing, strengths, single, batch_compute = [], [], [], []
+        for rule_index in (False, True):
+            for shared in (False, True):
+                engine = BatchEngine(rule_base, centroid='breakpoints', rule_index=rule_index,
+                                     share_subexpressions=shared)
+                memberships = engine.fuzzify(batch)
+                candidates = engine.index.candidates(batch) if rule_index else None
+
+                best = np.inf
+                for _ in range(3):
+                    start = time.perf_counter()
+                    result = engine.fire(memberships, candidates)
+                    best = min(best, time.perf_counter() - start)
+                firing.append(best / len(batch) * 1e6)
+                strengths.append(result)
+
+                if shared:
+                    best = np.inf
+                    for _ in range(3):
+                        start = time.perf_counter()
+                        engine.compute(batch)
+                        best = min(best, time.perf_counter() - start)
+                    batch_compute.append(best / len(batch) * 1e6)
+
+                if rule_index:
+                    start = time.perf_counter()
+                    for row in singles:
+                        engine.compute(row)
+                    single.append((time.perf_counter() - start) / len(singles) * 1e6)
+
+        # Sharing only reorders fmin/fmax operands, which doesn't change a single bit
+        assert all(np.array_equal(strengths[0], other) for other in strengths[1:]), "rule strengths differ"
+        per_rule = sum(tree_operations(expression) for expression, _ in engine.rules)
+        chosen = 'indexed' if engine._index_pays(len(batch)) else 'all rules'
+        shared = engine.dag.operations()
+        print(f"{len(rules):6d} | {per_rule:9d} {shared:6d} ({shared / per_rule:3.0%}) | "
+              f"{firing[0]:9.2f} {firing[1]:8.2f} | {firing[2]:9.2f} {firing[3]:8.2f} | "
+              f"{batch_compute[0]:8.2f} {batch_compute[1]:8.2f} ({chosen}) | "
+              f"{single[0]:8.0f} us {single[1]:8.0f} us")
+
+
+if __name__ == '__main__':
+    main()
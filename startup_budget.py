@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+import sys
+
+# Seconds each step may take in a fresh interpreter. `import A1` must stay cheap because
+# every worker and CLI call pays it. The first inference includes importing skfuzzy and
+# building the model, which only happens once per process; the last step rebuilds the
+# model with skfuzzy already loaded and runs it through the batch engine. Workers load
+# the compiled model from the disk cache instead, without importing skfuzzy at all.
+BUDGET = {
+    'import A1': 0.3,
+    'cached compiled model, batch inference': 0.3,
+    'first train.compute()': 2.0,
+    'rebuilt model, batch inference': 1.0,
+}
+
+# Runs in a separate interpreter so nothing is already imported or built
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import A1
+timings = {'import A1': time.perf_counter() - start}
+timings['matplotlib imported'] = 'matplotlib' in sys.modules
+
+import batch_engine, model_definition
+start = time.perf_counter()
+batch_engine.BatchEngine(model_definition.load_model(), centroid='breakpoints').compute([[90, 15, 200, 150, 750, 12]])
+timings['cached compiled model, batch inference'] = time.perf_counter() - start
+timings['skfuzzy imported'] = 'skfuzzy' in sys.modules
+
+start = time.perf_counter()
+train = A1.lighting_system().train
+for label, value in zip(['ambient light', 'distance', 'traffic activity', 'pedestrian activity', 'visibility',
+                         'time of day'], [90, 15, 200, 150, 750, 12]):
+    train.input[label] = value
+train.compute()
+timings['first train.compute()'] = time.perf_counter() - start
+
+A1.lighting_system.cache_clear()
+start = time.perf_counter()
+batch_engine.BatchEngine(A1.lighting_system().train_ctrl, centroid='breakpoints').compute([[90, 15, 200, 150, 750, 12]])
+timings['rebuilt model, batch inference'] = time.perf_counter() - start
+
+print(json.dumps(timings))
+'''
+
+
+def measure(runs=3):
+    # Best of a few fresh interpreters, to keep disk cache effects out of the numbers.
+    # Compile the model into the cache first, as a deployment would before starting workers.
+    # The probes import the repo's modules, so run them from here wherever we were started.
+    here = os.path.dirname(os.path.abspath(__file__))
+    subprocess.run([sys.executable, '-c', 'import model_definition; model_definition.load_model()'],
+                   check=True, cwd=here)
+    best = {}
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True,
+                                cwd=here).stdout
+        timings = json.loads(output)
+        if timings.pop('matplotlib imported'):
+            raise RuntimeError("importing A1 pulled in matplotlib")
+        if timings.pop('skfuzzy imported'):
+            raise RuntimeError("loading the compiled model pulled in skfuzzy")
+        for step, seconds in timings.items():
+            best[step] = min(seconds, best.get(step, seconds))
+    return best
+
+
+def main():
+    timings = measure()
+    over = False
+    for step, limit in BUDGET.items():
+        status = "OK" if timings[step] <= limit else "OVER BUDGET"
+        over |= timings[step] > limit
+        print(f"{step:<40} {timings[step] * 1000:8.1f} ms  (budget {limit * 1000:.0f} ms)  {status}")
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+from batch_engine import INPUT_BOUNDS, INPUT_LABELS, OUTPUT_LABELS, BatchEngine
+from model_definition import load_model
+
+# Row status written next to every result
+OK = 'ok'
+INVALID = 'invalid'            # missing or non-numeric value
+OUT_OF_RANGE = 'out of range'  # outside the bounds get_float_input enforces
+NO_RULE_FIRED = 'no rule fired'
+
+
+def column_name(name):
+    # Accept 'ambient light', 'ambient_light' or 'Ambient Light' as the same column
+    return name.strip().lower().replace('_', ' ')
+
+
+def read_records(stream, fmt):
+    # Yield one dict per input row without reading the whole file
+    if fmt == 'jsonl':
+        for line in stream:
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield record if isinstance(record, dict) else {}
+    else:
+        yield from csv.DictReader(stream)
+
+
+def parse_chunk(records):
+    # Turn a chunk of records into an N x 6 array, with a status per row
+    values = np.full((len(records), len(INPUT_LABELS)), np.nan)
+    status = []
+    for i, record in enumerate(records):
+        fields = {column_name(key): value for key, value in record.items() if key is not None}
+        try:
+            values[i] = [float(fields[label]) for label in INPUT_LABELS]
+        except (KeyError, TypeError, ValueError):
+            status.append(INVALID)
+            continue
+        if not np.all(np.isfinite(values[i])):
+            status.append(INVALID)
+        elif np.any(values[i] < INPUT_BOUNDS[:, 0]) or np.any(values[i] > INPUT_BOUNDS[:, 1]):
+            status.append(OUT_OF_RANGE)
+        else:
+            status.append(OK)
+    return values, status
+
+
+class ResultWriter:
+    # Writes each input record back out with brightness, colour temperature and status appended
+
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        self.writer = None
+
+    def write(self, record, outputs, status):
+        row = dict(record)
+        for label, value in zip(OUTPUT_LABELS, outputs):
+            row[label] = None if math.isnan(value) else float(value)
+        row['status'] = status
+
+        if self.fmt == 'jsonl':
+            self.stream.write(json.dumps(row) + '\n')
+            return
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.stream, fieldnames=list(row), extrasaction='ignore')
+            self.writer.writeheader()
+        self.writer.writerow(row)
+
+
+def process(engine, source, sink, fmt, chunk_size=4096):
+    # Stream source through the engine a chunk at a time; returns row counts per status
+    counts = dict.fromkeys([OK, NO_RULE_FIRED, OUT_OF_RANGE, INVALID], 0)
+    writer = ResultWriter(sink, fmt)
+    records = read_records(source, fmt)
+
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            break
+
+        values, status = parse_chunk(chunk)
+        valid = np.array([s == OK for s in status])
+        outputs = np.full((len(chunk), len(OUTPUT_LABELS)), np.nan)
+        fired = np.zeros(len(chunk), dtype=bool)
+        if valid.any():
+            # Ask the engine which rows fired a rule: with a fallback they aren't NaN
+            brightness, colour_temp, fired[valid] = engine.compute(values[valid], with_fired=True)
+            outputs[valid] = np.column_stack([brightness, colour_temp])
+
+        for record, result, row_fired, row_status in zip(chunk, outputs, fired, status):
+            if row_status == OK and not row_fired:
+                row_status = NO_RULE_FIRED
+            counts[row_status] += 1
+            writer.write(record, result, row_status)
+        sink.flush()
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute brightness and colour temperature for a stream of sensor readings.")
+    parser.add_argument('input', nargs='?', default='-', help="CSV or JSONL file of readings (default: stdin)")
+    parser.add_argument('-o', '--output', default='-', help="where to write the results (default: stdout)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help="input and output format (default: from the file extension, csv for stdin)")
+    parser.add_argument('--chunk-size', type=int, default=4096, help="readings evaluated together (default: 4096)")
+    parser.add_argument('--model', help="model definition file (default: lighting_model.json)")
+    args = parser.parse_args()
+
+    fmt = args.format or ('jsonl' if args.input.endswith(('.jsonl', '.ndjson')) else 'csv')
+    source = sys.stdin if args.input == '-' else open(args.input, newline='')
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+
+    engine = BatchEngine(load_model(args.model), centroid='breakpoints')
+
+    start = time.perf_counter()
+    try:
+        counts = process(engine, source, sink, fmt, args.chunk_size)
+    finally:
+        for stream in (source, sink):
+            if stream not in (sys.stdin, sys.stdout):
+                stream.close()
+    elapsed = time.perf_counter() - start
+
+    # Summary goes to stderr so stdout only carries results
+    total = sum(counts.values())
+    print(f"Processed {total} rows in {elapsed:.2f} s ({total / max(elapsed, 1e-9):.0f} rows/s)", file=sys.stderr)
+    for row_status, count in counts.items():
+        print(f"  {row_status}: {count}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import numpy as np
+
+
+class SupportIndex:
+    # Maps each input's support intervals to the rules that can fire there.
+    #
+    # Every membership function is zero outside a finite support, so each input universe
+    # splits into pieces on which a fixed set of terms is non-zero. A rule is an AND of
+    # clauses; a clause that reads a single variable can only be non-zero on some of that
+    # variable's pieces. For each variable and piece we store which rules are still
+    # possible, and a reading's candidates are the AND of those rows over its inputs.
+    # Clauses that mix variables or use NOT don't restrict anything, so the candidate set
+    # is always a superset of the rules that actually fire.
+
+    def __init__(self, antecedents, expressions, labels):
+        self.labels = labels
+        self.n_rules = len(expressions)
+        self.ranges = {}
+        self.bounds = {}
+        self.allowed = {}
+        self.packed = {}
+
+        for label in labels:
+            var = antecedents[label]
+            x = var.universe.astype(float)
+            supports = {term_label: _support(x, term.mf) for term_label, term in var.terms.items()}
+
+            # Piece k lies between bounds[k - 1] and bounds[k]; pieces 0 and len(bounds) are
+            # outside every support and only reached from a value sitting on the edge
+            bounds = np.unique([end for support in supports.values() for end in support] + [x[0], x[-1]])
+            middles = np.concatenate([[-np.inf], (bounds[:-1] + bounds[1:]) / 2, [np.inf]])
+            nonzero = {term_label: (middles > lo) & (middles < hi) for term_label, (lo, hi) in supports.items()}
+
+            allowed = np.ones((len(middles), self.n_rules), dtype=bool)
+            for rule, expression in enumerate(expressions):
+                for clause in _conjuncts(expression):
+                    if _variables(clause) == {label}:
+                        possible = _possible(clause, nonzero)
+                        if possible is not None:
+                            allowed[:, rule] &= possible
+
+            self.ranges[label] = (x[0], x[-1])
+            self.bounds[label] = bounds
+            self.allowed[label] = allowed
+            # Same table with 8 rules per byte, so a lookup touches R/8 bytes per reading
+            self.packed[label] = np.packbits(allowed, axis=1)
+
+    def candidates(self, inputs):
+        # Rules that may fire for each reading, shape (N, number of rules)
+        candidates = None
+        for column, label in enumerate(self.labels):
+            bounds, packed = self.bounds[label], self.packed[label]
+            values = np.clip(inputs[:, column], *self.ranges[label])
+            # Readings are clipped to the universe like skfuzzy does; a value sitting
+            # exactly on a boundary belongs to both neighbouring pieces
+            left = np.searchsorted(bounds, values, side='left')
+            right = np.searchsorted(bounds, values, side='right')
+            possible = packed[left] | packed[right]
+            candidates = possible if candidates is None else np.bitwise_and(candidates, possible, out=candidates)
+        return np.unpackbits(candidates, axis=1, count=self.n_rules).view(bool)
+
+    def rules_by_interval(self, label):
+        # Human-readable view of the index: ((lo, hi), [rule numbers]) for each piece of one input
+        bounds, allowed = self.bounds[label], self.allowed[label]
+        return [((bounds[k - 1], bounds[k]), [rule + 1 for rule in np.flatnonzero(allowed[k])])
+                for k in range(1, len(bounds))]
+
+
+def _support(x, mf):
+    # Open interval on which a sampled (linearly interpolated) membership is non-zero
+    nonzero = np.flatnonzero(mf)
+    if len(nonzero) == 0:
+        return x[0], x[0]
+    lo = x[nonzero[0] - 1] if nonzero[0] > 0 else x[0] - 1
+    hi = x[nonzero[-1] + 1] if nonzero[-1] < len(x) - 1 else x[-1] + 1
+    return lo, hi
+
+
+def _conjuncts(expression):
+    if expression[0] == 'and':
+        return _conjuncts(expression[1]) + _conjuncts(expression[2])
+    return [expression]
+
+
+def _variables(expression):
+    if expression[0] == 'term':
+        return {expression[1]}
+    return set().union(*(_variables(part) for part in expression[1:]))
+
+
+def _possible(expression, nonzero):
+    # Boolean per piece: can this single-variable clause be non-zero there? None if unknown
+    kind = expression[0]
+    if kind == 'term':
+        return nonzero[expression[2]]
+    if kind == 'not':
+        return None
+    left, right = _possible(expression[1], nonzero), _possible(expression[2], nonzero)
+    if left is None or right is None:
+        return None
+    return left & right if kind == 'and' else left | right
+
+
+def synthetic_rules(system, n_rules, seed=0):
+    # Extra scenarios in the style of A1.py: for every input an OR of one or two
+    # neighbouring terms, ANDed together, mapped to a random brightness/colour pair
+    from skfuzzy import control as ctrl
+
+    rng = np.random.default_rng(seed)
+    variables = [system.ambient_light, system.distance, system.traffic_activity,
+                 system.pedestrian_activity, system.visibility, system.time_of_day]
+    rules = []
+    for _ in range(n_rules):
+        antecedent = None
+        for var in variables:
+            terms = list(var.terms)
+            first = rng.integers(len(terms))
+            clause = var[terms[first]]
+            if first + 1 < len(terms) and rng.random() < 0.5:
+                clause = clause | var[terms[first + 1]]
+            antecedent = clause if antecedent is None else antecedent & clause
+        brightness = list(system.brightness.terms)[rng.integers(len(system.brightness.terms))]
+        colour = list(system.colour_temp.terms)[rng.integers(len(system.colour_temp.terms))]
+        rules.append(ctrl.Rule(antecedent, (system.brightness[brightness], system.colour_temp[colour])))
+    return rules
+
+
+def main():
+    import time
+    from types import SimpleNamespace
+
+    import A1
+    from batch_engine import BatchEngine, random_inputs
+
+    system = A1.lighting_system()
+    batch = random_inputs(5000, seed=11)
+    singles = random_inputs(200, seed=12)
+
+    print(f"{'rules':>6} | {'rule firing, batch of 5000':^27} | {'single reading, full compute':^29} | candidates")
+    print(f"{'':>6} | {'all rules':>12} {'indexed':>14} | {'all rules':>13} {'indexed':>15} | per reading")
+    for extra in (0, 45, 225, 945):
+        rules = system.rules + synthetic_rules(system, extra)
+        # Only what BatchEngine reads; skfuzzy's ControlSystem graph takes minutes to build
+        # for hundreds of rules and is not needed here
+        rule_base = SimpleNamespace(antecedents=list(system.train_ctrl.antecedents),
+                                    consequents=list(system.train_ctrl.consequents), rules=rules)
+        firing, single = [], []
+        for rule_index in (False, True):
+            # Per-rule firing, so the index alone is measured (rule_dag.main covers sharing)
+            engine = BatchEngine(rule_base, centroid='breakpoints', rule_index=rule_index,
+                                 share_subexpressions=False)
+            memberships = engine.fuzzify(batch)
+
+            start = time.perf_counter()
+            engine.fire(memberships, engine.index.candidates(batch) if rule_index else None)
+            firing.append((time.perf_counter() - start) / len(batch) * 1e6)
+
+            start = time.perf_counter()
+            for row in singles:
+                engine.compute(row)
+            single.append((time.perf_counter() - start) / len(singles) * 1e6)
+
+        candidates = engine.index.candidates(batch).sum(axis=1).mean()
+        print(f"{len(rules):6d} | {firing[0]:9.2f} us {firing[1]:11.2f} us | "
+              f"{single[0]:10.0f} us {single[1]:12.0f} us | {candidates:10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from A1 import SURFACE_FIXED_VALUES
+from batch_engine import INPUT_LABELS, BatchEngine
+from model_definition import cache_directory, load_model
+
+# Bump when the cached surfaces or their plots change, so old cache entries are ignored
+SURFACE_VERSION = 1
+
+# Every pair of inputs, in the order choose_input_variables lists them
+ALL_PAIRS = list(itertools.combinations(INPUT_LABELS, 2))
+
+
+def surface_key(model, first, second, resolution, fixed_values, centroid):
+    # Only the values of the four inputs held fixed matter, not the two being swept
+    fixed = {label: float(value) for label, value in fixed_values.items() if label not in (first, second)}
+    key = [SURFACE_VERSION, model.digest, first, second, resolution, sorted(fixed.items()), centroid]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+def surface_grid(model, first, second, resolution, fixed_values):
+    # Readings for a resolution x resolution sweep of two inputs over their universes,
+    # the same grid show_3d_graph evaluates; the other inputs stay at fixed_values
+    universes = {var.label: var.universe for var in model.antecedents}
+    x, y = np.meshgrid(np.linspace(universes[first].min(), universes[first].max(), resolution),
+                       np.linspace(universes[second].min(), universes[second].max(), resolution))
+    inputs = np.empty((x.size, len(INPUT_LABELS)))
+    for column, label in enumerate(INPUT_LABELS):
+        inputs[:, column] = fixed_values[label]
+    inputs[:, INPUT_LABELS.index(first)] = x.ravel()
+    inputs[:, INPUT_LABELS.index(second)] = y.ravel()
+    return x, y, inputs
+
+
+def _write_atomically(path, write):
+    # Write through a temporary file and rename, so a reader never sees half a file
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+        write(f)
+    os.replace(f.name, path)
+
+
+def render_surface(path, first, second, x, y, brightness, colour_temp):
+    # Both outputs side by side, drawn like show_3d_graph does, without a display.
+    # Grid points where no rule fired are drawn at 0.
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(14, 6))
+    for position, (z, label) in enumerate(((brightness, "Brightness"), (colour_temp, "Colour Temperature")), 1):
+        z = np.nan_to_num(z, nan=0.0)
+        ax = fig.add_subplot(1, 2, position, projection='3d')
+        ax.plot_surface(x, y, z, rstride=1, cstride=1, cmap='viridis', linewidth=0.4, antialiased=True)
+
+        ax.contourf(x, y, z, zdir='z', offset=-2.5, cmap='viridis', alpha=0.5)
+        ax.contourf(x, y, z, zdir='x', offset=x.max()*1.5, cmap='viridis', alpha=0.5)
+        ax.contourf(x, y, z, zdir='y', offset=y.max()*1.5, cmap='viridis', alpha=0.5)
+        ax.set_xlabel(first)
+        ax.set_ylabel(second)
+        ax.set_zlabel(label)
+
+        ax.set_title(label)
+        ax.view_init(30, 200)
+
+    _write_atomically(path, lambda f: fig.savefig(f, format='png', dpi=100))
+    plt.close(fig)
+    return path
+
+
+def generate_atlas(output_dir, pairs=None, resolution=100, fixed_values=None, formats=('png', 'npz'),
+                   model_path=None, workers=None, cache_dir=None, centroid='breakpoints'):
+    # Surfaces for the given input pairs (all 15 by default), written to output_dir as
+    # <first>__<second>.npz / .png. Surfaces and plots are cached under the model hash,
+    # resolution and fixed values, so only what changed is computed or drawn again.
+    # Returns counts of what was computed, rendered and taken from the cache.
+    pairs = pairs or ALL_PAIRS
+    fixed_values = dict(SURFACE_FIXED_VALUES, **(fixed_values or {}))
+    model = load_model(model_path)
+    cache = os.path.join(cache_dir or cache_directory(), 'surfaces')
+    counts = {'computed': 0, 'rendered': 0, 'cached': 0}
+
+    keys = {pair: surface_key(model, *pair, resolution, fixed_values, centroid) for pair in pairs}
+    missing = [pair for pair in pairs if not os.path.exists(os.path.join(cache, keys[pair] + '.npz'))]
+
+    # Every missing surface in one batch through the engine
+    if missing:
+        grids = [surface_grid(model, *pair, resolution, fixed_values) for pair in missing]
+        brightness, colour_temp = BatchEngine(model, centroid=centroid).compute(np.vstack([g[2] for g in grids]))
+        size = resolution * resolution
+        for i, (pair, (x, y, _)) in enumerate(zip(missing, grids)):
+            rows = slice(i * size, (i + 1) * size)
+            surface = {'x': x, 'y': y, 'brightness': brightness[rows].reshape(x.shape),
+                       'colour_temp': colour_temp[rows].reshape(x.shape)}
+            _write_atomically(os.path.join(cache, keys[pair] + '.npz'), lambda f: np.savez(f, **surface))
+        counts['computed'] = len(missing)
+
+    # Plots are the slow part; draw the missing ones in parallel
+    to_render = []
+    if 'png' in formats:
+        for pair in pairs:
+            if not os.path.exists(os.path.join(cache, keys[pair] + '.png')):
+                with np.load(os.path.join(cache, keys[pair] + '.npz')) as surface:
+                    to_render.append((os.path.join(cache, keys[pair] + '.png'), *pair, surface['x'], surface['y'],
+                                      surface['brightness'], surface['colour_temp']))
+    if len(to_render) > 1 and (workers or os.cpu_count()) > 1:
+        with ProcessPoolExecutor(min(workers or os.cpu_count(), len(to_render))) as pool:
+            list(pool.map(render_surface, *zip(*to_render)))
+    else:
+        for job in to_render:
+            render_surface(*job)
+    counts['rendered'] = len(to_render)
+    counts['cached'] = len(pairs) - len(missing)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for pair in pairs:
+        name = f"{pair[0]}__{pair[1]}".replace(' ', '_')
+        for fmt in formats:
+            shutil.copyfile(os.path.join(cache, f'{keys[pair]}.{fmt}'), os.path.join(output_dir, f'{name}.{fmt}'))
+    return counts
+
+
+def _pair(text):
+    first, second = (label.strip() for label in text.split(','))
+    for label in (first, second):
+        if label not in INPUT_LABELS:
+            raise argparse.ArgumentTypeError(f"unknown input {label!r}")
+    if first == second:
+        raise argparse.ArgumentTypeError("choose two different inputs")
+    return first, second
+
+
+def _fixed_value(text):
+    label, value = text.rsplit('=', 1)
+    if label.strip() not in INPUT_LABELS:
+        raise argparse.ArgumentTypeError(f"unknown input {label.strip()!r}")
+    return label.strip(), float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render control surfaces for pairs of inputs to PNG and NPZ.")
+    parser.add_argument('output', help="directory to write the surfaces to")
+    parser.add_argument('--pair', type=_pair, action='append', dest='pairs', metavar='"FIRST,SECOND"',
+                        help="input pair to draw, e.g. \"ambient light,time of day\" (default: all 15)")
+    parser.add_argument('--resolution', type=int, default=100, help="grid points along each axis (default: 100)")
+    parser.add_argument('--fix', type=_fixed_value, action='append', default=[], metavar='"INPUT=VALUE"',
+                        help="value to hold an input at when it is not swept (defaults as in A1.py)")
+    parser.add_argument('--format', choices=['png', 'npz'], action='append', dest='formats',
+                        help="what to write (default: both)")
+    parser.add_argument('--workers', type=int, help="processes drawing plots (default: one per CPU)")
+    parser.add_argument('--model', help="model definition file (default: lighting_model.json)")
+    parser.add_argument('--cache-dir', help=f"where surfaces are cached (default: {cache_directory()})")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate_atlas(args.output, args.pairs, args.resolution, dict(args.fix), tuple(args.formats or ('png', 'npz')),
+                            args.model, args.workers, args.cache_dir)
+    print(f"{len(args.pairs or ALL_PAIRS)} surfaces in {time.perf_counter() - start:.1f} s "
+          f"({counts['computed']} computed, {counts['rendered']} plots drawn, {counts['cached']} from cache) -> {args.output}")
+
+
+if __name__ == '__main__':
+    main()
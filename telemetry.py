@@ -0,0 +1,117 @@
+import json
+import time
+
+import numpy as np
+
+STAGES = ('fuzzification', 'rule evaluation', 'aggregation', 'defuzzification')
+
+# Upper edges of the firing-strength histogram buckets (strengths of fired rules, in (0, 1])
+STRENGTH_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+class Telemetry:
+    # Counters a BatchEngine fills in while it runs, when one is attached:
+    #   engine.telemetry = Telemetry(len(engine.rules))
+    # With no telemetry attached the engine skips all of this.
+
+    def __init__(self, n_rules):
+        self.n_rules = n_rules
+        self.reset()
+
+    def reset(self):
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.batches = 0
+        self.readings = 0
+        self.no_rule_fired = 0
+        self.rule_fired = np.zeros(self.n_rules, dtype=np.int64)
+        self.strength_sum = np.zeros(self.n_rules)
+        self.strength_buckets = np.zeros((self.n_rules, len(STRENGTH_BUCKETS)), dtype=np.int64)
+
+    def stage(self, name, start):
+        # Add the time since start to a stage and return now, to start the next stage
+        now = time.perf_counter()
+        self.stage_seconds[name] += now - start
+        return now
+
+    def record_firing(self, strengths):
+        # strengths: (rules, readings), as returned by BatchEngine.fire
+        fired = strengths > 0
+        self.batches += 1
+        self.readings += strengths.shape[1]
+        self.no_rule_fired += int(np.count_nonzero(~fired.any(axis=0)))
+        self.rule_fired += fired.sum(axis=1)
+        self.strength_sum += strengths.sum(axis=1)
+        for rule in np.flatnonzero(fired.any(axis=1)):
+            bucket = np.searchsorted(STRENGTH_BUCKETS, strengths[rule, fired[rule]])
+            self.strength_buckets[rule] += np.bincount(bucket, minlength=len(STRENGTH_BUCKETS))[:len(STRENGTH_BUCKETS)]
+
+    def snapshot(self):
+        return {
+            'batches': self.batches,
+            'readings': self.readings,
+            'no rule fired': self.no_rule_fired,
+            'stage seconds': dict(self.stage_seconds),
+            'rules': {
+                f'rule{rule + 1}': {
+                    'fired': int(self.rule_fired[rule]),
+                    'strength sum': float(self.strength_sum[rule]),
+                    'strength histogram': dict(zip(map(str, STRENGTH_BUCKETS), self.strength_buckets[rule].tolist())),
+                }
+                for rule in range(self.n_rules)
+            },
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix='street_lighting'):
+        # Prometheus text exposition format
+        lines = [
+            f'# TYPE {prefix}_stage_seconds_total counter',
+            *(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {seconds:.9f}'
+              for stage, seconds in self.stage_seconds.items()),
+            f'# TYPE {prefix}_batches_total counter',
+            f'{prefix}_batches_total {self.batches}',
+            f'# TYPE {prefix}_readings_total counter',
+            f'{prefix}_readings_total {self.readings}',
+            f'# TYPE {prefix}_no_rule_fired_total counter',
+            f'{prefix}_no_rule_fired_total {self.no_rule_fired}',
+            f'# TYPE {prefix}_rule_fired_total counter',
+            *(f'{prefix}_rule_fired_total{{rule="rule{rule + 1}"}} {count}'
+              for rule, count in enumerate(self.rule_fired)),
+            f'# TYPE {prefix}_rule_strength histogram',
+        ]
+        for rule in range(self.n_rules):
+            label = f'rule="rule{rule + 1}"'
+            for edge, count in zip(STRENGTH_BUCKETS, np.cumsum(self.strength_buckets[rule])):
+                lines.append(f'{prefix}_rule_strength_bucket{{{label},le="{edge}"}} {count}')
+            lines.append(f'{prefix}_rule_strength_bucket{{{label},le="+Inf"}} {self.rule_fired[rule]}')
+            lines.append(f'{prefix}_rule_strength_sum{{{label}}} {self.strength_sum[rule]:.9f}')
+            lines.append(f'{prefix}_rule_strength_count{{{label}}} {self.rule_fired[rule]}')
+        return '\n'.join(lines) + '\n'
+
+
+def main():
+    import A1
+    from batch_engine import BatchEngine, random_inputs
+
+    engine = BatchEngine(A1.train_ctrl, centroid='breakpoints')
+    inputs = random_inputs(20000, seed=13)
+
+    def run():
+        start = time.perf_counter()
+        for chunk in np.array_split(inputs, 20):
+            engine.compute(chunk)
+        return time.perf_counter() - start
+
+    run()
+    off = min(run() for _ in range(3))
+    engine.telemetry = Telemetry(len(engine.rules))
+    on = min(run() for _ in range(3))
+
+    print(engine.telemetry.to_prometheus())
+    print(f"telemetry off: {off * 1000:.1f} ms, on: {on * 1000:.1f} ms ({(on - off) / off:+.1%})")
+
+
+if __name__ == '__main__':
+    main()
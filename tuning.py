@@ -0,0 +1,230 @@
+import argparse
+import copy
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from batch_engine import INPUT_LABELS, OUTPUT_LABELS, BatchEngine, random_inputs
+from model_definition import DEFAULT_MODEL, compile_definition, load_definition, term_function
+from stream_readings import OK, column_name, parse_chunk, read_records
+
+# Log rows: the six inputs followed by the desired brightness and colour temperature
+LOG_COLUMNS = INPUT_LABELS + OUTPUT_LABELS
+
+# Log shared with the scoring workers, attached by _init_worker
+_worker_block = None
+_worker_log = None
+
+
+def read_log(path, chunk_size=65536):
+    # Logged readings with the outputs they should have produced, as an N x 8 array.
+    # Rows with bad inputs, or without any target, are skipped; a missing target is NaN.
+    fmt = 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+    chunks = []
+    with open(path, newline='') as f:
+        records = read_records(f, fmt)
+        while chunk := list(itertools.islice(records, chunk_size)):
+            inputs, status = parse_chunk(chunk)
+            targets = np.full((len(chunk), len(OUTPUT_LABELS)), np.nan)
+            for i, record in enumerate(chunk):
+                fields = {column_name(key): value for key, value in record.items() if key is not None}
+                for j, label in enumerate(OUTPUT_LABELS):
+                    try:
+                        targets[i, j] = float(fields[label])
+                    except (KeyError, TypeError, ValueError):
+                        pass
+            keep = (np.array(status) == OK) & np.isfinite(targets).any(axis=1)
+            chunks.append(np.hstack([inputs, targets])[keep])
+    return np.vstack(chunks) if chunks else np.empty((0, len(LOG_COLUMNS)))
+
+
+def output_spans(definition):
+    # Width of each output universe, so brightness and colour errors weigh the same
+    spans = {var['label']: var['universe'][1] - var['universe'][0] for var in definition['outputs']}
+    return np.array([spans[label] for label in OUTPUT_LABELS], dtype=float)
+
+
+def score(definition, log):
+    # Normalised RMS error of a model over a log: errors are divided by the output's
+    # universe width, and a target the model gives no output for (no rule fired) counts
+    # as an error of 1
+    outputs = np.column_stack(BatchEngine(compile_definition(definition), centroid='breakpoints')
+                              .compute(log[:, :len(INPUT_LABELS)]))
+    targets = log[:, len(INPUT_LABELS):]
+    errors = (outputs - targets) / output_spans(definition)
+    errors[np.isnan(outputs) & ~np.isnan(targets)] = 1.0
+    return float(np.sqrt(np.nanmean(errors ** 2)))
+
+
+def _init_worker(block_name, shape):
+    global _worker_block, _worker_log
+    _worker_block = shared_memory.SharedMemory(name=block_name)
+    _worker_log = np.ndarray(shape, dtype=np.float64, buffer=_worker_block.buf)
+
+
+def _score_in_worker(definition):
+    return score(definition, _worker_log)
+
+
+def tunable_terms(definition, selection=None):
+    # (group, variable index, term label, pinned) of every term whose parameters may move.
+    # selection holds variable labels ("brightness") or terms ("brightness[high]");
+    # None means every term given as a parameter list. Parameters sitting on a universe
+    # end are pinned there, so a shoulder stays a shoulder.
+    slots = []
+    for group in ('inputs', 'outputs'):
+        for index, var in enumerate(definition[group]):
+            for term_label, term in var['terms'].items():
+                _, parameters = term_function(term)
+                wanted = (selection is None or var['label'] in selection
+                          or f"{var['label']}[{term_label}]" in selection)
+                if wanted and isinstance(parameters, list):
+                    start, stop, _ = var['universe']
+                    pinned = (np.array(parameters) <= start) | (np.array(parameters) >= stop)
+                    slots.append((group, index, term_label, pinned))
+    return slots
+
+
+def perturb(definition, slots, rng, scale, share=0.1):
+    # A copy of the definition with a random share of the terms moved by Gaussian noise
+    # (scale is a fraction of the universe width). Parameters stay in order, inside the
+    # universe and on its sampling grid.
+    candidate = copy.deepcopy(definition)
+    chosen = rng.choice(len(slots), max(1, round(share * len(slots))), replace=False)
+    for group, index, term_label, pinned in (slots[i] for i in chosen):
+        var = candidate[group][index]
+        start, stop, step = var['universe']
+        term = var['terms'][term_label]
+        function, parameters = term_function(term)
+        parameters = np.array(parameters, dtype=float)
+        moved = parameters + rng.normal(0, scale * (stop - start), len(parameters))
+        moved = np.sort(np.where(pinned, parameters, np.clip(moved, start, stop)))
+        moved = np.round(np.round(moved / step) * step, 6)
+        term[function] = [int(p) if p == int(p) else float(p) for p in moved]
+    return candidate
+
+
+def tune(definition, log, selection=None, generations=20, population=16, scale=0.05, workers=None, seed=0,
+         progress=None):
+    # Elitist random search: every generation scores `population` perturbations of the
+    # best definition so far, in parallel over the whole log, and keeps the best of them
+    # if it beats the current one. The step shrinks after a generation without progress.
+    # Returns (best definition, its score, score of the starting definition).
+    rng = np.random.default_rng(seed)
+    slots = tunable_terms(definition, selection)
+    if not slots:
+        raise ValueError(f"Nothing to tune for {selection!r}")
+
+    log = np.ascontiguousarray(log, dtype=np.float64)
+    block = shared_memory.SharedMemory(create=True, size=log.nbytes)
+    try:
+        np.ndarray(log.shape, dtype=np.float64, buffer=block.buf)[:] = log
+        # Start the tracker before the workers attach, as in parallel_engine.ShardedEngine
+        resource_tracker.ensure_running()
+        with ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(block.name, log.shape)) as pool:
+            best = definition
+            initial = best_score = pool.submit(_score_in_worker, definition).result()
+            for generation in range(generations):
+                candidates = [perturb(best, slots, rng, scale) for _ in range(population)]
+                scores = list(pool.map(_score_in_worker, candidates))
+                winner = int(np.argmin(scores))
+                if scores[winner] < best_score:
+                    best, best_score = candidates[winner], scores[winner]
+                else:
+                    scale *= 0.7
+                if progress:
+                    progress(generation, best_score, scale)
+    finally:
+        block.close()
+        block.unlink()
+    return best, best_score, initial
+
+
+def changed_terms(before, after):
+    # (variable label, term label, old parameters, new parameters) for every term that moved
+    changes = []
+    for group in ('inputs', 'outputs'):
+        for old, new in zip(before[group], after[group]):
+            for term_label in old['terms']:
+                if old['terms'][term_label] != new['terms'][term_label]:
+                    changes.append((old['label'], term_label, old['terms'][term_label], new['terms'][term_label]))
+    return changes
+
+
+def write_definition(definition, path):
+    with open(path, 'w') as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            yaml.safe_dump(definition, f, sort_keys=False)
+        else:
+            json.dump(definition, f, indent=2)
+            f.write('\n')
+
+
+def make_demo_log(path, rows, seed=0):
+    # A log from a hidden "true" model: the shipped one with every term moved a little,
+    # keeping only readings where that model drives the lamp
+    rng = np.random.default_rng(seed)
+    definition = load_definition()
+    truth = perturb(definition, tunable_terms(definition), rng, 0.03, share=1.0)
+    inputs = random_inputs(rows * 4, seed=seed)
+    outputs = np.column_stack(BatchEngine(compile_definition(truth), centroid='breakpoints').compute(inputs))
+    keep = np.flatnonzero(~np.isnan(outputs).any(axis=1))[:rows]
+    np.savetxt(path, np.hstack([inputs[keep], outputs[keep]]), delimiter=',', fmt='%.6g',
+               header=','.join(LOG_COLUMNS), comments='')
+    return truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit membership function parameters to logged lamp data.")
+    parser.add_argument('log', help="CSV or JSONL log with the six inputs plus the desired brightness "
+                                    "and colour temperature")
+    parser.add_argument('-o', '--output', required=True, help="where to write the tuned model definition")
+    parser.add_argument('--model', default=DEFAULT_MODEL, help="model definition to start from")
+    parser.add_argument('--tune', action='append', metavar='VARIABLE[TERM]',
+                        help="variable or term to tune, e.g. \"brightness\" or \"pedestrian activity[heavy]\" "
+                             "(default: every term)")
+    parser.add_argument('--generations', type=int, default=20, help="search rounds (default: 20)")
+    parser.add_argument('--population', type=int, default=16, help="candidates scored per round (default: 16)")
+    parser.add_argument('--scale', type=float, default=0.05,
+                        help="initial step, as a fraction of each universe's width (default: 0.05)")
+    parser.add_argument('--workers', type=int, help="scoring processes (default: one per CPU)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--make-demo-log', type=int, metavar='ROWS',
+                        help="first write a synthetic log of ROWS rows to LOG, from a perturbed copy of the model")
+    args = parser.parse_args()
+
+    if args.make_demo_log:
+        make_demo_log(args.log, args.make_demo_log, seed=args.seed + 1)
+
+    start = time.perf_counter()
+    log = read_log(args.log)
+    definition = load_definition(args.model)
+    print(f"{len(log)} usable log rows read in {time.perf_counter() - start:.1f} s")
+
+    def progress(generation, best_score, scale):
+        print(f"  generation {generation + 1:3d}: score {best_score:.5f} (step {scale:.4f})")
+
+    start = time.perf_counter()
+    best, best_score, initial = tune(definition, log, args.tune, args.generations, args.population, args.scale,
+                                     args.workers, args.seed, progress)
+    elapsed = time.perf_counter() - start
+    candidates = args.generations * args.population
+    print(f"{candidates} candidates in {elapsed:.1f} s ({candidates * len(log) / elapsed:.0f} readings/s)")
+    print(f"score {initial:.5f} -> {best_score:.5f} (normalised RMS error; 1 = no output at all)")
+
+    for label, term, old, new in changed_terms(definition, best):
+        print(f"  {label}[{term}]: {old} -> {new}")
+    best['description'] = (definition.get('description', '') + f" (tuned on {os.path.basename(args.log)})").strip()
+    write_definition(best, args.output)
+    print(f"written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()